@@ -0,0 +1,259 @@
+import argparse
+import mmap
+import time
+from array import array
+
+from ChessEngine import GameState
+
+"""
+Win/draw/loss bitbases for king and one piece against a lone king, built by retrograde
+analysis over every placement of the three pieces with GameState's own move generation.
+Positions are stored from the side with the piece (the strong side) as white; black
+positions are looked up mirrored. Each position takes 2 bits, the file holds a header
+and one table per material set, and is read through mmap so a probe is a few lookups
+"""
+
+# Material sets and the strong side's piece, in the order of the tables in the file
+bitbase_materials = (("KQK", "Q"), ("KRK", "R"), ("KPK", "p"))
+bitbase_header = b"WDLBASE1"
+positions_per_table = 2 * 64 * 64 * 64  # Side to move, strong king, weak king, piece
+bytes_per_table = positions_per_table // 4
+
+# Stored values, the result for the side to move
+stored_draw = 0
+stored_win = 1
+stored_loss = 2
+stored_illegal = 3
+
+# Probe results
+win = 1
+draw = 0
+loss = -1
+
+
+def bitbase_index(weak_to_move, strong_king, weak_king, piece):
+    return weak_to_move << 18 | strong_king << 12 | weak_king << 6 | piece
+
+
+"""
+Set up a GameState with the strong king, weak king and piece of a table index. White is
+the strong side
+"""
+
+
+def setup_position(gs, piece_type, index):
+    weak_to_move = index >> 18
+    strong_king = (index >> 12) & 63
+    weak_king = (index >> 6) & 63
+    piece = index & 63
+    board = [["  "] * 8 for _ in range(8)]
+    board[strong_king // 8][strong_king % 8] = "wK"
+    board[weak_king // 8][weak_king % 8] = "bK"
+    board[piece // 8][piece % 8] = "w" + piece_type
+    gs.board = board
+    gs.white_king_location = (strong_king // 8, strong_king % 8)
+    gs.black_king_location = (weak_king // 8, weak_king % 8)
+    gs.white_to_move = not weak_to_move
+    gs.piece_squares = gs.compute_piece_squares()
+
+
+"""
+Can the side not to move's king be taken, which makes the position impossible
+"""
+
+
+def opponent_in_check(gs):
+    gs.white_to_move = not gs.white_to_move
+    in_check = gs.checking_pins_and_checks()[0]
+    gs.white_to_move = not gs.white_to_move
+    return in_check
+
+
+"""
+Retrograde analysis of one material set: every legal position gets its successors, the
+mates are lost and the rest is resolved in passes until nothing changes. The lone king
+can't win, so strong side positions end as win or draw and weak side positions as loss
+or draw. Queen and rook promotions are looked up in the finished tables of
+promoted_tables
+"""
+
+
+def build_table(piece_type, promoted_tables=None):
+    values = bytearray([stored_illegal]) * positions_per_table
+    first_successor = array("i", [0]) * (positions_per_table + 1)
+    successors = array("i")  # Table indices, -1 for a drawn position outside the table
+    unresolved = []
+    gs = GameState()
+    gs.white_castle_king_side = gs.white_castle_queen_side = False
+    gs.black_castle_king_side = gs.black_castle_queen_side = False
+    gs.en_passant_possible = ()
+    for index in range(positions_per_table):
+        first_successor[index] = len(successors)
+        strong_king = (index >> 12) & 63
+        weak_king = (index >> 6) & 63
+        piece = index & 63
+        if strong_king == weak_king or piece == strong_king or piece == weak_king:
+            continue
+        if piece_type == "p" and (piece < 8 or piece >= 56):  # Pawns never stand there
+            continue
+        setup_position(gs, piece_type, index)
+        if opponent_in_check(gs):
+            continue
+        moves = gs.get_valid_moves()
+        if not moves:
+            values[index] = stored_loss if gs.checkmate else stored_draw
+            continue
+        values[index] = stored_draw
+        weak_to_move = index >> 18
+        won = False
+        for move in moves:
+            end = move.end_row * 8 + move.end_col
+            if move.piece_captured != "  ":  # Only the lone king captures, leaving KK
+                successors.append(-1)
+            elif move.pawn_promotion:
+                table = promoted_tables.get(move.promotion_piece)
+                child = bitbase_index(1, strong_king, weak_king, end)
+                if table is not None and table[child] == stored_loss:
+                    won = True  # Minor piece promotions are draws
+            elif move.piece_moved == "wK":
+                successors.append(bitbase_index(1, end, weak_king, piece))
+            elif move.piece_moved == "bK":
+                successors.append(bitbase_index(0, strong_king, end, piece))
+            else:
+                successors.append(bitbase_index(1, strong_king, weak_king, end))
+        if won:
+            values[index] = stored_win
+        elif not weak_to_move or -1 not in successors[first_successor[index] :]:
+            unresolved.append(index)  # A lone king that can capture can't lose
+    first_successor[positions_per_table] = len(successors)
+
+    changed = True
+    while changed:
+        changed = False
+        still_unresolved = []
+        for index in unresolved:
+            start = first_successor[index]
+            end = first_successor[index + 1]
+            if index >> 18:  # Lone king to move, lost when every move loses
+                if all(values[successors[i]] == stored_win for i in range(start, end)):
+                    values[index] = stored_loss
+                    changed = True
+                    continue
+            elif any(values[successors[i]] == stored_loss for i in range(start, end)):
+                values[index] = stored_win
+                changed = True
+                continue
+            still_unresolved.append(index)
+        unresolved = still_unresolved
+    return values
+
+
+def pack_table(values):
+    packed = bytearray(bytes_per_table)
+    for index in range(positions_per_table):
+        packed[index >> 2] |= values[index] << ((index & 3) * 2)
+    return packed
+
+
+def build_bitbases(path):
+    tables = {}
+    with open(path, "wb") as bitbase_file:
+        bitbase_file.write(bitbase_header)
+        for material, piece_type in bitbase_materials:
+            start = time.perf_counter()
+            tables[piece_type] = build_table(piece_type, tables)
+            bitbase_file.write(pack_table(tables[piece_type]))
+            counts = [tables[piece_type].count(value) for value in range(4)]
+            print(
+                "%s: %d wins, %d draws, %d losses, %d illegal in %.1f s"
+                % (
+                    material,
+                    counts[stored_win],
+                    counts[stored_draw],
+                    counts[stored_loss],
+                    counts[stored_illegal],
+                    time.perf_counter() - start,
+                )
+            )
+
+
+"""
+Bitbase file mapped into memory. probe returns win, draw or loss for the side to move,
+or None when the position isn't covered
+"""
+
+
+class Bitbases:
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        expected_size = len(bitbase_header) + len(bitbase_materials) * bytes_per_table
+        if (
+            self.data[: len(bitbase_header)] != bitbase_header
+            or len(self.data) != expected_size
+        ):
+            self.close()
+            raise ValueError("Not a bitbase file: " + path)
+        self.offsets = {
+            piece_type: len(bitbase_header) + i * bytes_per_table
+            for i, (_, piece_type) in enumerate(bitbase_materials)
+        }
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def probe(self, gs):
+        white_squares = gs.piece_squares["w"]
+        black_squares = gs.piece_squares["b"]
+        if len(white_squares) + len(black_squares) > 3:
+            return None
+        if len(white_squares) + len(black_squares) == 2:
+            return draw  # Bare kings
+        strong = "w" if len(white_squares) == 2 else "b"
+        board = gs.board
+        piece_square = None
+        for r, c in white_squares if strong == "w" else black_squares:
+            if board[r][c][1] != "K":
+                piece_square = (r, c)
+        piece_type = board[piece_square[0]][piece_square[1]][1]
+        if piece_type == "B" or piece_type == "N":
+            return draw  # A single minor piece can't mate
+        if strong == "w":
+            strong_king = gs.white_king_location
+            weak_king = gs.black_king_location
+            flip = 0
+        else:
+            strong_king = gs.black_king_location
+            weak_king = gs.white_king_location
+            flip = 7  # Mirror the ranks so that the strong side plays up the board
+        index = bitbase_index(
+            gs.white_to_move != (strong == "w"),
+            (strong_king[0] ^ flip) * 8 + strong_king[1],
+            (weak_king[0] ^ flip) * 8 + weak_king[1],
+            (piece_square[0] ^ flip) * 8 + piece_square[1],
+        )
+        stored = (
+            self.data[self.offsets[piece_type] + (index >> 2)] >> ((index & 3) * 2)
+        ) & 3
+        if stored == stored_win:
+            return win
+        elif stored == stored_loss:
+            return loss
+        elif stored == stored_draw:
+            return draw
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate the KQK, KRK and KPK bitbases"
+    )
+    parser.add_argument("path", nargs="?", default="bitbases.bin", help="file to write")
+    args = parser.parse_args()
+    build_bitbases(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1018 @@
+import time
+from array import array
+
+from ChessEngine import (
+    GameState,
+    Move,
+    all_moves,
+    capture_moves,
+    no_en_passant_file,
+    piece_codes,
+    piece_phase,
+    piece_square_eg,
+    piece_square_mg,
+    promotion_pieces,
+    quiet_moves,
+    zobrist_black_to_move,
+    zobrist_castling,
+    zobrist_en_passant,
+    zobrist_pieces,
+)
+
+"""
+Squares are numbered sq = row * 8 + col, with row 0 being the 8th rank so that the
+numbering follows the same orientation as GameState.board
+"""
+
+squares = [(sq // 8, sq % 8) for sq in range(64)]
+all_squares = (1 << 64) - 1
+
+# Ray directions as (row step, col step), the first four are rook directions
+rook_directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
+bishop_directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+directions = rook_directions + bishop_directions
+# Rays towards higher square numbers find their nearest blocker with the lowest bit
+positive_direction = [d[0] * 8 + d[1] > 0 for d in directions]
+
+
+def build_step_table(steps):
+    table = []
+    for r, c in squares:
+        mask = 0
+        for dr, dc in steps:
+            end_row = r + dr
+            end_col = c + dc
+            if 0 <= end_row < 8 and 0 <= end_col < 8:
+                mask |= 1 << (end_row * 8 + end_col)
+        table.append(mask)
+    return table
+
+
+def build_rays():
+    rays = []
+    for dr, dc in directions:
+        table = []
+        for r, c in squares:
+            mask = 0
+            end_row = r + dr
+            end_col = c + dc
+            while 0 <= end_row < 8 and 0 <= end_col < 8:
+                mask |= 1 << (end_row * 8 + end_col)
+                end_row += dr
+                end_col += dc
+            table.append(mask)
+        rays.append(table)
+    return rays
+
+
+def build_between():
+    between = [[0] * 64 for _ in range(64)]
+    for d in range(len(directions)):
+        for sq in range(64):
+            ray = rays[d][sq]
+            while ray:
+                bit = ray & -ray
+                target = bit.bit_length() - 1
+                # Squares strictly between sq and target are on both rays
+                between[sq][target] = rays[d][sq] & ~rays[d][target] & ~bit
+                ray ^= bit
+    return between
+
+
+knight_attacks = build_step_table(
+    ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+)
+king_attacks = build_step_table(
+    ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+)
+# Squares attacked by a pawn of the given color standing on a square
+pawn_attacks = {
+    "w": build_step_table(((-1, -1), (-1, 1))),
+    "b": build_step_table(((1, -1), (1, 1))),
+}
+rays = build_rays()
+between = build_between()
+rank_masks = [0xFF << (8 * r) for r in range(8)]
+file_a = sum(1 << (8 * r) for r in range(8))
+file_h = file_a << 7
+
+
+def scan_slider_attacks(sq, occupied, line_directions):
+    attacks = 0
+    for d in line_directions:
+        ray = rays[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive_direction[d]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= rays[d][blocker]
+        attacks |= ray
+    return attacks
+
+
+"""
+Slider attacks are looked up per line (file, rank and both diagonals) in a table keyed
+by the occupancy of the line's inner squares, the edge squares never block anything
+further
+"""
+
+
+def build_line_tables(line_directions):
+    masks = []
+    tables = []
+    for sq in range(64):
+        mask = 0
+        for d in line_directions:
+            ray = rays[d][sq]
+            if ray:
+                if positive_direction[d]:
+                    edge = 1 << (ray.bit_length() - 1)
+                else:
+                    edge = ray & -ray
+                mask |= ray ^ edge
+        table = {}
+        subset = 0
+        while True:  # Walk every subset of the mask
+            table[subset] = scan_slider_attacks(sq, subset, line_directions)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+file_masks, file_attacks = build_line_tables((0, 2))
+rank_line_masks, rank_attacks = build_line_tables((1, 3))
+diagonal_masks, diagonal_attacks = build_line_tables((4, 7))
+anti_diagonal_masks, anti_diagonal_attacks = build_line_tables((5, 6))
+
+
+def rook_attacks(sq, occupied):
+    return (
+        file_attacks[sq][occupied & file_masks[sq]]
+        | rank_attacks[sq][occupied & rank_line_masks[sq]]
+    )
+
+
+def bishop_attacks(sq, occupied):
+    return (
+        diagonal_attacks[sq][occupied & diagonal_masks[sq]]
+        | anti_diagonal_attacks[sq][occupied & anti_diagonal_masks[sq]]
+    )
+
+
+"""
+Moves of the bitboard backend. What a move changes follows from its squares, the piece
+moved, the piece captured and the promotion piece alone, so it is all worked out once
+when the move is first generated: the bitboard, occupancy and board squares to change,
+the Zobrist key and evaluation differences and the castling rights that survive it.
+make_move and undo_move only apply them. Each move is built once and kept in a table,
+the same object is handed out whenever that move comes up again, so it must never be
+changed
+"""
+
+# Castling rights that survive a move from or to a rook's starting square
+castle_keep_squares = {63: 15 ^ 1, 56: 15 ^ 2, 7: 15 ^ 4, 0: 15 ^ 8}
+
+
+class BitMove(Move):
+
+    __slots__ = (
+        "bit_changes",
+        "occupancy_changes",
+        "board_changes",
+        "board_restores",
+        "removed_squares",
+        "added_squares",
+        "zobrist_change",
+        "mg_change",
+        "eg_change",
+        "phase_change",
+        "castle_keep",
+        "new_en_passant",
+        "captured_code",
+        "resets_clock",
+        "black_moved",
+        "king_moved",
+        "start_square",
+        "end_square",
+    )
+
+    def __init__(
+        self,
+        start,
+        end,
+        piece_moved,
+        piece_captured,
+        promotion_piece="",
+        en_passant=False,
+    ):
+        start_row, start_col = squares[start]
+        end_row, end_col = squares[end]
+        super().__init__(
+            squares[start],
+            squares[end],
+            None,
+            en_passant=en_passant,
+            pawn_promotion=promotion_piece != "",
+            castle=piece_moved[1] == "K" and abs(end_col - start_col) == 2,
+            promotion_piece=promotion_piece or "Q",
+        )
+        self._piece_moved = piece_moved
+        self._piece_captured = piece_captured
+        self.start_square = squares[start]
+        self.end_square = squares[end]
+        color = piece_moved[0]
+        placed = color + promotion_piece if promotion_piece else piece_moved
+        bit_changes = {piece_moved: 1 << start}
+        bit_changes[placed] = bit_changes.get(placed, 0) ^ 1 << end
+        ally_bits = 1 << start | 1 << end
+        occupancy_changes = []
+        board_changes = [(start_row, start_col, "  "), (end_row, end_col, placed)]
+        board_restores = [
+            (end_row, end_col, "  " if en_passant else piece_captured),
+            (start_row, start_col, piece_moved),
+        ]
+        removed_squares = [(color, squares[start])]
+        added_squares = [(color, squares[end])]
+        zobrist_change = (
+            zobrist_black_to_move
+            ^ zobrist_pieces[piece_moved][start]
+            ^ zobrist_pieces[placed][end]
+        )
+        mg = piece_square_mg[placed][end] - piece_square_mg[piece_moved][start]
+        eg = piece_square_eg[placed][end] - piece_square_eg[piece_moved][start]
+        phase = piece_phase[placed] - piece_phase[piece_moved]  # Promotions
+        if piece_captured != "  ":
+            captured_sq = start_row * 8 + end_col if en_passant else end
+            bit_changes[piece_captured] = 1 << captured_sq
+            occupancy_changes.append((piece_captured[0], 1 << captured_sq))
+            removed_squares.append((piece_captured[0], squares[captured_sq]))
+            zobrist_change ^= zobrist_pieces[piece_captured][captured_sq]
+            mg -= piece_square_mg[piece_captured][captured_sq]
+            eg -= piece_square_eg[piece_captured][captured_sq]
+            phase -= piece_phase[piece_captured]
+            if en_passant:
+                board_changes.append((start_row, end_col, "  "))
+                board_restores.append((start_row, end_col, piece_captured))
+        if self.castle:
+            rook = color + "R"
+            if end_col > start_col:  # King side
+                rook_start, rook_end = end + 1, end - 1
+            else:  # Queen side
+                rook_start, rook_end = end - 2, end + 1
+            bit_changes[rook] = 1 << rook_start | 1 << rook_end
+            ally_bits |= 1 << rook_start | 1 << rook_end
+            board_changes += [
+                (end_row, rook_start % 8, "  "),
+                (end_row, rook_end % 8, rook),
+            ]
+            board_restores += [
+                (end_row, rook_end % 8, "  "),
+                (end_row, rook_start % 8, rook),
+            ]
+            removed_squares.append((color, squares[rook_start]))
+            added_squares.append((color, squares[rook_end]))
+            zobrist_change ^= (
+                zobrist_pieces[rook][rook_start] ^ zobrist_pieces[rook][rook_end]
+            )
+            mg += piece_square_mg[rook][rook_end] - piece_square_mg[rook][rook_start]
+            eg += piece_square_eg[rook][rook_end] - piece_square_eg[rook][rook_start]
+        occupancy_changes.append((color, ally_bits))
+        self.new_en_passant = ()
+        if piece_moved[1] == "p" and abs(end_row - start_row) == 2:
+            self.new_en_passant = ((start_row + end_row) // 2, start_col)
+            zobrist_change ^= zobrist_en_passant[start_col]
+        keep = castle_keep_squares
+        castle_keep = keep.get(start, 15) & keep.get(end, 15)
+        if piece_moved[1] == "K":
+            castle_keep &= 12 if color == "w" else 3
+        self.bit_changes = tuple(bit_changes.items())
+        self.occupancy_changes = tuple(occupancy_changes)
+        self.board_changes = tuple(board_changes)
+        self.board_restores = tuple(board_restores)
+        self.removed_squares = tuple(removed_squares)
+        self.added_squares = tuple(added_squares)
+        self.zobrist_change = zobrist_change
+        self.mg_change = mg
+        self.eg_change = eg
+        self.phase_change = phase
+        self.castle_keep = castle_keep
+        self.captured_code = piece_codes[piece_captured]
+        self.resets_clock = piece_moved[1] == "p" or piece_captured != "  "
+        self.black_moved = color == "b"
+        self.king_moved = piece_moved[1] == "K"
+
+
+"""
+Tables of the moves built so far, one per piece moved and piece captured (with the
+promotion piece and an "e" for en passant added to the name), indexed by the low 12 bits
+of the move_id. Quiet moves are looked up the most, their tables exist from the start
+"""
+
+move_tables = {
+    color + piece + "  ": [None] * 4096 for color in "wb" for piece in "pNBRQK"
+}
+
+
+"""
+Quiet moves of a piece from a square keyed by square | target squares << 6. Most pieces
+have the same targets as in the previous position, so their list is looked up whole
+instead of move by move. A table is emptied when it grows past move_list_limit
+"""
+
+move_lists = {color + piece: {} for color in "wb" for piece in "pNBRQK"}
+move_list_limit = 1 << 16
+
+
+def move_table(name):
+    table = move_tables.get(name)
+    if table is None:
+        table = move_tables[name] = [None] * 4096
+    return table
+
+
+def get_bit_move(
+    piece_moved, piece_captured, start, end, promotion_piece="", en_passant=False
+):
+    table = move_table(
+        piece_moved + piece_captured + promotion_piece + ("e" if en_passant else "")
+    )
+    move = table[start | end << 6]
+    if move is None:
+        move = table[start | end << 6] = BitMove(
+            start, end, piece_moved, piece_captured, promotion_piece, en_passant
+        )
+    return move
+
+
+"""
+The quiet moves of a piece from sq to the quiet target squares, built on a miss in
+move_lists and kept there
+"""
+
+
+def list_quiet_moves(piece, sq, quiet):
+    lists = move_lists[piece]
+    key = sq | quiet << 6
+    listed = []
+    while quiet:
+        bit = quiet & -quiet
+        quiet ^= bit
+        listed.append(get_bit_move(piece, "  ", sq, bit.bit_length() - 1))
+    if len(lists) >= move_list_limit:
+        lists.clear()
+    listed = lists[key] = tuple(listed)
+    return listed
+
+
+"""
+GameState backed by bitboards, one 64-bit integer per piece type and color plus an
+occupancy mask per color. make_move and undo_move apply the changes worked out in the
+BitMove, they also keep the board list, piece squares, Zobrist key and evaluation of
+GameState up to date so that everything reading those (SmartMoveFinder, Bitbases,
+ChessMain) works the same on both backends
+"""
+
+
+class BitboardGameState(GameState):
+
+    def __init__(self):
+        super().__init__()
+        self.bitboards = {}
+        self.occupancy = {"w": 0, "b": 0}
+        self.sync_bitboards()
+
+    """
+    Rebuild every bitboard from the board list
+    """
+
+    def sync_bitboards(self):
+        self.bitboards = {
+            color + piece: 0
+            for color in "wb"
+            for piece in ("p", "R", "N", "B", "Q", "K")
+        }
+        self.occupancy = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                square = self.board[r][c]
+                if square != "  ":
+                    bit = 1 << (r * 8 + c)
+                    self.bitboards[square] |= bit
+                    self.occupancy[square[0]] |= bit
+
+    def load_fen(self, fen):
+        super().load_fen(fen)
+        self.sync_bitboards()
+
+    """
+    The BitMove of a move generated by GameState or built from the squares, with the
+    pieces read from the board
+    """
+
+    def as_bit_move(self, move):
+        piece_moved = self.board[move.start_row][move.start_col]
+        if move.en_passant:
+            piece_captured = ("b" if piece_moved[0] == "w" else "w") + "p"
+        else:
+            piece_captured = self.board[move.end_row][move.end_col]
+        return get_bit_move(
+            piece_moved,
+            piece_captured,
+            move.start_row * 8 + move.start_col,
+            move.end_row * 8 + move.end_col,
+            move.promotion_piece,
+            move.en_passant,
+        )
+
+    """
+    Hash and killer moves looked up by move_id are BitMoves too, their pieces are fixed
+    when they are found instead of read off the board whenever they're asked for
+    """
+
+    def get_legal_move(self, move_id):
+        move = super().get_legal_move(move_id)
+        if move is None:
+            return None
+        return self.as_bit_move(move)
+
+    def make_move(self, move):
+        if move.__class__ is not BitMove:
+            move = self.as_bit_move(move)
+        # Save the state the move can't give back by itself, as GameState.push_state
+        ply = len(self.move_log)
+        undo_stack = self.undo_stack
+        if 2 * ply + 2 > len(undo_stack):  # Deeper than ever before, double the room
+            undo_stack.extend(array("Q", bytes(8 * len(undo_stack))))
+        rights = self.castling_rights()
+        if self.en_passant_possible == ():
+            en_passant_file = no_en_passant_file
+        else:
+            en_passant_file = self.en_passant_possible[1]
+        key = self.zobrist_key
+        undo_stack[2 * ply] = (
+            rights
+            | en_passant_file << 4
+            | move.captured_code << 8
+            | self.halfmove_clock << 12
+        )
+        undo_stack[2 * ply + 1] = key
+        self.move_log.append(move)
+        self.white_to_move = not self.white_to_move
+        bitboards = self.bitboards
+        for piece, bits in move.bit_changes:
+            bitboards[piece] ^= bits
+        occupancy = self.occupancy
+        for color, bits in move.occupancy_changes:
+            occupancy[color] ^= bits
+        board = self.board
+        for r, c, piece in move.board_changes:
+            board[r][c] = piece
+        piece_squares = self.piece_squares
+        for color, square in move.removed_squares:
+            piece_squares[color].remove(square)
+        for color, square in move.added_squares:
+            piece_squares[color].add(square)
+        self.mg_score += move.mg_change
+        self.eg_score += move.eg_change
+        self.phase += move.phase_change
+        if move.king_moved:
+            if move.black_moved:
+                self.black_king_location = move.end_square
+            else:
+                self.white_king_location = move.end_square
+        self.en_passant_possible = move.new_en_passant
+        if move.resets_clock:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if move.black_moved:
+            self.fullmove_number += 1
+        key ^= move.zobrist_change ^ zobrist_en_passant[en_passant_file]
+        if rights & move.castle_keep != rights:
+            self.set_castling_rights(rights & move.castle_keep)
+            key ^= (
+                zobrist_castling[rights] ^ zobrist_castling[rights & move.castle_keep]
+            )
+        self.zobrist_key = key
+        if self.zobrist_debug:
+            self.check_zobrist_key()
+
+    def undo_move(self):
+        if len(self.move_log) == 0:  # Nothing to undo
+            return
+        move = self.move_log.pop()
+        ply = len(self.move_log)
+        state = self.undo_stack[2 * ply]
+        self.zobrist_key = self.undo_stack[2 * ply + 1]
+        self.white_to_move = not self.white_to_move
+        bitboards = self.bitboards
+        for piece, bits in move.bit_changes:
+            bitboards[piece] ^= bits
+        occupancy = self.occupancy
+        for color, bits in move.occupancy_changes:
+            occupancy[color] ^= bits
+        board = self.board
+        for r, c, piece in move.board_restores:
+            board[r][c] = piece
+        piece_squares = self.piece_squares
+        for color, square in move.added_squares:
+            piece_squares[color].remove(square)
+        for color, square in move.removed_squares:
+            piece_squares[color].add(square)
+        self.mg_score -= move.mg_change
+        self.eg_score -= move.eg_change
+        self.phase -= move.phase_change
+        if move.king_moved:
+            if move.black_moved:
+                self.black_king_location = move.start_square
+            else:
+                self.white_king_location = move.start_square
+        en_passant_file = state >> 4 & 0xF
+        if en_passant_file == no_en_passant_file:
+            self.en_passant_possible = ()
+        else:  # Behind the pawn the other side just pushed
+            self.en_passant_possible = (2 if self.white_to_move else 5, en_passant_file)
+        self.halfmove_clock = state >> 12
+        if move.black_moved:
+            self.fullmove_number -= 1
+        if move.castle_keep != 15:
+            self.set_castling_rights(state & 0xF)
+        if self.zobrist_debug:
+            self.check_zobrist_key()
+        self.checkmate = False
+        self.stalemate = False
+
+    def king_in_check(self):
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+        else:
+            ally_color, enemy_color = "b", "w"
+        king_sq = self.bitboards[ally_color + "K"].bit_length() - 1
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        return self.attackers_to(king_sq, enemy_color, occupied) != 0
+
+    def has_non_pawn_material(self):
+        bitboards = self.bitboards
+        color = "w" if self.white_to_move else "b"
+        return (
+            bitboards[color + "N"]
+            | bitboards[color + "B"]
+            | bitboards[color + "R"]
+            | bitboards[color + "Q"]
+        ) != 0
+
+    """
+    All enemy pieces attacking a square for a given occupancy, exclude removes pieces
+    (e.g. a pawn taken en passant) from consideration
+    """
+
+    def attackers_to(self, sq, enemy_color, occupied, exclude=0):
+        bitboards = self.bitboards
+        ally_color = "b" if enemy_color == "w" else "w"
+        rooks = bitboards[enemy_color + "R"] | bitboards[enemy_color + "Q"]
+        bishops = bitboards[enemy_color + "B"] | bitboards[enemy_color + "Q"]
+        attackers = (
+            (knight_attacks[sq] & bitboards[enemy_color + "N"])
+            | (king_attacks[sq] & bitboards[enemy_color + "K"])
+            | (pawn_attacks[ally_color][sq] & bitboards[enemy_color + "p"])
+        )
+        if rooks:
+            attackers |= rook_attacks(sq, occupied) & rooks
+        if bishops:
+            attackers |= bishop_attacks(sq, occupied) & bishops
+        return attackers & ~exclude
+
+    """
+    All legal moves, computed from check and pin masks instead of a board walk. A stage
+    narrows the target squares to enemy pieces (captures) or empty squares (quiet moves)
+    """
+
+    def get_valid_moves(self, stage=all_moves):
+        if stage == all_moves and self.move_cache is not None:
+            cached = self.cached_valid_moves()
+            if cached is not None:
+                return cached
+        moves = []
+        bitboards = self.bitboards
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+        else:
+            ally_color, enemy_color = "b", "w"
+        allies = self.occupancy[ally_color]
+        enemies = self.occupancy[enemy_color]
+        occupied = allies | enemies
+        king_bit = bitboards[ally_color + "K"]
+        king_sq = king_bit.bit_length() - 1
+        if stage == capture_moves:
+            stage_mask = enemies
+        elif stage == quiet_moves:
+            stage_mask = ~occupied & all_squares
+        else:
+            stage_mask = all_squares
+
+        checkers = self.attackers_to(king_sq, enemy_color, occupied)
+        self.in_check = checkers != 0
+
+        # King moves, the king itself is removed so it can't hide behind its own square
+        without_king = occupied ^ king_bit
+        targets = king_attacks[king_sq] & ~allies & stage_mask
+        safe = 0
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if not self.attackers_to(bit.bit_length() - 1, enemy_color, without_king):
+                safe |= bit
+        king = ally_color + "K"
+        quiet = safe & ~enemies
+        if quiet:
+            moves.extend(
+                move_lists[king].get(king_sq | quiet << 6)
+                or list_quiet_moves(king, king_sq, quiet)
+            )
+        if safe & enemies:
+            self.add_captures(king, king_sq, safe & enemies, moves)
+
+        if not checkers and stage != capture_moves:
+            self.get_castle_bit_moves(king_sq, enemy_color, occupied, moves)
+
+        if checkers & (checkers - 1) == 0:  # Not in double check
+            if checkers:
+                checker_sq = checkers.bit_length() - 1
+                check_mask = checkers | between[king_sq][checker_sq]
+            else:
+                check_mask = all_squares
+            pin_masks = self.get_pin_masks(king_sq, ally_color, enemy_color, occupied)
+            self.get_piece_moves(
+                ally_color,
+                allies,
+                enemies,
+                occupied,
+                check_mask & stage_mask,
+                pin_masks,
+                moves,
+            )
+            self.get_pawn_bit_moves(
+                ally_color,
+                enemy_color,
+                enemies,
+                occupied,
+                king_sq,
+                check_mask,
+                pin_masks,
+                moves,
+                stage,
+            )
+
+        if stage != all_moves:  # Only part of the moves, can't tell mate from it
+            return moves
+
+        if len(moves) == 0:
+            if self.in_check:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
+        if self.move_cache is not None:
+            self.move_cache.put(self.zobrist_key, moves, self.in_check)
+
+        return moves
+
+    """
+    Map of pinned square -> squares the pinned piece may still move to
+    """
+
+    def get_pin_masks(self, king_sq, ally_color, enemy_color, occupied):
+        bitboards = self.bitboards
+        enemies = self.occupancy[enemy_color]
+        allies = self.occupancy[ally_color]
+        # Look through our own pieces to find sliders lined up with the king
+        snipers = (
+            rook_attacks(king_sq, enemies)
+            & (bitboards[enemy_color + "R"] | bitboards[enemy_color + "Q"])
+        ) | (
+            bishop_attacks(king_sq, enemies)
+            & (bitboards[enemy_color + "B"] | bitboards[enemy_color + "Q"])
+        )
+        pin_masks = {}
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            sniper_sq = bit.bit_length() - 1
+            blockers = between[king_sq][sniper_sq] & occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & allies:
+                pin_masks[blockers.bit_length() - 1] = between[king_sq][sniper_sq] | bit
+        return pin_masks
+
+    """
+    Captures of a piece from sq on each target square, taken from the move tables
+    """
+
+    def add_captures(self, piece, sq, targets, moves):
+        board = self.board
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            moves.append(get_bit_move(piece, board[end >> 3][end & 7], sq, end))
+
+    """
+    Knight, bishop, rook and queen moves
+    """
+
+    def get_piece_moves(
+        self, ally_color, allies, enemies, occupied, check_mask, pin_masks, moves
+    ):
+        bitboards = self.bitboards
+        add_captures = self.add_captures
+        allowed = check_mask & ~allies
+        for piece, rook_like, bishop_like in (
+            (ally_color + "N", False, False),
+            (ally_color + "B", False, True),
+            (ally_color + "R", True, False),
+            (ally_color + "Q", True, True),
+        ):
+            pieces = bitboards[piece]
+            lists = move_lists[piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                # rook_attacks and bishop_attacks written out, this is the hot loop
+                targets = 0
+                if not (rook_like or bishop_like):
+                    targets = knight_attacks[sq]
+                if rook_like:
+                    targets = (
+                        file_attacks[sq][occupied & file_masks[sq]]
+                        | rank_attacks[sq][occupied & rank_line_masks[sq]]
+                    )
+                if bishop_like:
+                    targets |= (
+                        diagonal_attacks[sq][occupied & diagonal_masks[sq]]
+                        | anti_diagonal_attacks[sq][occupied & anti_diagonal_masks[sq]]
+                    )
+                targets &= allowed
+                if sq in pin_masks:
+                    targets &= pin_masks[sq]
+                quiet = targets & ~enemies
+                if quiet:
+                    moves.extend(
+                        lists.get(sq | quiet << 6) or list_quiet_moves(piece, sq, quiet)
+                    )
+                if targets & enemies:
+                    add_captures(piece, sq, targets & enemies, moves)
+
+    """
+    Pawn pushes, captures, promotions and en passant
+    """
+
+    def get_pawn_bit_moves(
+        self,
+        ally_color,
+        enemy_color,
+        enemies,
+        occupied,
+        king_sq,
+        check_mask,
+        pin_masks,
+        moves,
+        stage=all_moves,
+    ):
+        board = self.board
+        pawn = ally_color + "p"
+        pawns = self.bitboards[pawn]
+        if ally_color == "w":
+            step = -8
+            start_rank = rank_masks[6]
+            back_rank = rank_masks[0]
+        else:
+            step = 8
+            start_rank = rank_masks[1]
+            back_rank = rank_masks[7]
+        empty = ~occupied & all_squares
+        pinned = 0
+        for sq in pin_masks:
+            pinned |= 1 << sq
+        free = pawns & ~pinned
+
+        # Unpinned pawns are pushed and captured as a whole set, one shift per direction
+        if step < 0:
+            single = (free >> 8) & empty
+            double = ((single & rank_masks[5]) >> 8) & empty
+            left = ((free & ~file_a) >> 9) & enemies
+            right = ((free & ~file_h) >> 7) & enemies
+        else:
+            single = (free << 8) & empty
+            double = ((single & rank_masks[2]) << 8) & empty
+            left = ((free & ~file_a) << 7) & enemies
+            right = ((free & ~file_h) << 9) & enemies
+        # Promoting pushes are searched with the captures
+        if stage == capture_moves:
+            single &= back_rank
+            double = 0
+        elif stage == quiet_moves:
+            single &= ~back_rank
+            left = right = 0
+        single &= check_mask
+        double &= check_mask
+        # The other pushes depend on their target squares only, see move_lists
+        pushes = single & ~back_rank
+        if pushes or double:
+            lists = move_lists[pawn]
+            listed = lists.get(pushes | double << 64)
+            if listed is None:
+                listed = []
+                for targets, offset in ((pushes, step), (double, 2 * step)):
+                    while targets:
+                        target_bit = targets & -targets
+                        targets ^= target_bit
+                        end_sq = target_bit.bit_length() - 1
+                        listed.append(get_bit_move(pawn, "  ", end_sq - offset, end_sq))
+                if len(lists) >= move_list_limit:
+                    lists.clear()
+                listed = lists[pushes | double << 64] = tuple(listed)
+            moves.extend(listed)
+        for targets, offset in (
+            (single & back_rank, step),
+            (left & check_mask, step - 1),
+            (right & check_mask, step + 1),
+        ):
+            while targets:
+                target_bit = targets & -targets
+                targets ^= target_bit
+                end_sq = target_bit.bit_length() - 1
+                captured = board[end_sq >> 3][end_sq & 7]
+                if target_bit & back_rank:
+                    for piece in promotion_pieces:
+                        moves.append(
+                            get_bit_move(pawn, captured, end_sq - offset, end_sq, piece)
+                        )
+                else:
+                    moves.append(get_bit_move(pawn, captured, end_sq - offset, end_sq))
+
+        attack_table = pawn_attacks[ally_color]
+        pinned &= pawns
+        while pinned:  # Pinned pawns may only move along the pin
+            bit = pinned & -pinned
+            pinned ^= bit
+            sq = bit.bit_length() - 1
+            targets = 0
+            one_step = 1 << (sq + step)
+            if one_step & empty:
+                targets |= one_step
+                if bit & start_rank and (1 << (sq + 2 * step)) & empty:
+                    targets |= 1 << (sq + 2 * step)
+            if stage == capture_moves:
+                targets &= back_rank
+            elif stage == quiet_moves:
+                targets &= ~back_rank
+            if stage != quiet_moves:
+                targets |= attack_table[sq] & enemies
+            targets &= check_mask & pin_masks[sq]
+            while targets:
+                target_bit = targets & -targets
+                targets ^= target_bit
+                end_sq = target_bit.bit_length() - 1
+                captured = board[end_sq >> 3][end_sq & 7]
+                if target_bit & back_rank:
+                    for piece in promotion_pieces:
+                        moves.append(get_bit_move(pawn, captured, sq, end_sq, piece))
+                else:
+                    moves.append(get_bit_move(pawn, captured, sq, end_sq))
+
+        if self.en_passant_possible != () and stage != quiet_moves:
+            en_passant_bit = 1 << (
+                self.en_passant_possible[0] * 8 + self.en_passant_possible[1]
+            )
+            # Our pawns attacking the square are those an enemy pawn there attacks
+            enemy_table = pawn_attacks[enemy_color]
+            capturers = enemy_table[en_passant_bit.bit_length() - 1] & pawns
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+                self.get_en_passant_move(
+                    bit.bit_length() - 1,
+                    en_passant_bit,
+                    enemy_color,
+                    occupied,
+                    king_sq,
+                    moves,
+                )
+
+    """
+    En passant is checked by playing it out on the occupancy, that also covers the
+    case where both pawns leave the king's rank at once
+    """
+
+    def get_en_passant_move(
+        self, sq, en_passant_bit, enemy_color, occupied, king_sq, moves
+    ):
+        target_sq = en_passant_bit.bit_length() - 1
+        captured_sq = (sq // 8) * 8 + target_sq % 8
+        captured_bit = 1 << captured_sq
+        after = (occupied ^ (1 << sq) ^ captured_bit) | en_passant_bit
+        if not self.attackers_to(king_sq, enemy_color, after, captured_bit):
+            pawn = self.board[sq >> 3][sq & 7]
+            moves.append(
+                get_bit_move(pawn, enemy_color + "p", sq, target_sq, en_passant=True)
+            )
+
+    """
+    Castling, the squares between king and rook must be empty and the king may not pass
+    through or land on an attacked square
+    """
+
+    def get_castle_bit_moves(self, king_sq, enemy_color, occupied, moves):
+        if self.white_to_move:
+            king = "wK"
+            king_side = self.white_castle_king_side
+            queen_side = self.white_castle_queen_side
+        else:
+            king = "bK"
+            king_side = self.black_castle_king_side
+            queen_side = self.black_castle_queen_side
+        if (
+            king_side
+            and not occupied & (0b11 << (king_sq + 1))
+            and not self.attackers_to(king_sq + 1, enemy_color, occupied)
+            and not self.attackers_to(king_sq + 2, enemy_color, occupied)
+        ):
+            moves.append(get_bit_move(king, "  ", king_sq, king_sq + 2))
+        if (
+            queen_side
+            and not occupied & (0b111 << (king_sq - 3))
+            and not self.attackers_to(king_sq - 1, enemy_color, occupied)
+            and not self.attackers_to(king_sq - 2, enemy_color, occupied)
+        ):
+            moves.append(get_bit_move(king, "  ", king_sq, king_sq - 2))
+
+
+"""
+Measure legal-move generation throughput of both backends over the same positions
+"""
+
+benchmark_lines = [
+    "",
+    "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6",
+    "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7 e2e3 b8d7",
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6 c1e3 e7e5",
+    "e2e4 e7e6 d2d4 d7d5 b1c3 f8b4 e4e5 c7c5 a2a3 b4c3",
+    "e2e4 d7d5 e4d5 d8d5 b1c3 d5a5 d2d4 g8f6 g1f3 c8f5 f1c4 e7e6",
+]
+
+
+def play_line(gs, line):
+    for notation in line.split():
+        for move in gs.get_valid_moves():
+            if move.get_chess_notation() == notation:
+                gs.make_move(move)
+                break
+        else:
+            raise ValueError("Illegal move in benchmark line: " + notation)
+
+
+"""
+The backends take turns for a few rounds and the best round of each counts, which keeps
+other work on the machine out of the comparison
+"""
+
+
+def benchmark(repetitions=200, rounds=5):
+    backends = (("list board", GameState), ("bitboards", BitboardGameState))
+    positions = {}
+    for name, state_class in backends:
+        positions[name] = []
+        for line in benchmark_lines:
+            gs = state_class()
+            play_line(gs, line)
+            positions[name].append(gs)
+    best = {name: None for name, _ in backends}
+    for _ in range(rounds):
+        for name, _ in backends:
+            start = time.perf_counter()
+            generated = 0
+            for _ in range(repetitions):
+                for gs in positions[name]:
+                    generated += len(gs.get_valid_moves())
+            elapsed = time.perf_counter() - start
+            if best[name] is None or elapsed < best[name][0]:
+                best[name] = (elapsed, generated)
+    calls = repetitions * len(benchmark_lines)
+    for name, _ in backends:
+        elapsed, generated = best[name]
+        print(
+            "%-10s %8.0f positions/s %10.0f moves/s"
+            % (name, calls / elapsed, generated / elapsed)
+        )
+    print("Speedup: %.1fx" % (best["list board"][0] / best["bitboards"][0]))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,4 +1,243 @@
-import pygame as p
+import random
+from array import array
+
+# Move generation stages, the search asks for captures (and promotions) before quiet
+# moves
+all_moves = 0
+capture_moves = 1
+quiet_moves = 2
+
+# Pieces a pawn can promote to, best first, and their code in bits 12-14 of a move_id
+promotion_pieces = ("Q", "R", "B", "N")
+promotion_codes = {"N": 1, "B": 2, "R": 3, "Q": 4}
+
+"""
+Undo stack: make_move saves what it can't work out backwards in two 64-bit words per
+ply, the packed state (castling rights, en passant file, captured piece, halfmove clock)
+and the Zobrist key. The words live in a preallocated array, so making and taking back
+moves allocates nothing for it
+"""
+
+undo_stack_plies = 1024  # Room before the stack has to grow
+no_en_passant_file = 8
+# Captured pieces as small integers, 0 is nothing captured
+piece_names = (
+    ["  "] + ["w" + piece for piece in "pNBRQK"] + ["b" + piece for piece in "pNBRQK"]
+)
+piece_codes = {piece: code for code, piece in enumerate(piece_names)}
+
+"""
+Zobrist keys, seeded so that hashes are the same in every process and every run
+"""
+
+zobrist_random = random.Random(20250307)
+zobrist_pieces = {
+    color + piece: [zobrist_random.getrandbits(64) for _ in range(64)]
+    for color in "wb"
+    for piece in ("p", "R", "N", "B", "Q", "K")
+}
+zobrist_black_to_move = zobrist_random.getrandbits(64)
+# One key per combination of the four castling rights
+zobrist_castling = [zobrist_random.getrandbits(64) for _ in range(16)]
+# One key per en passant file, plus 0 for no en passant square
+zobrist_en_passant = [zobrist_random.getrandbits(64) for _ in range(8)] + [0]
+
+"""
+Evaluation in centipawns: material plus piece-square tables, one set for the middlegame
+and one for the endgame. The tables are written from white's side with the 8th rank
+first (the same orientation as the board), black uses them mirrored
+"""
+
+material_mg = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+material_eg = {"p": 120, "N": 300, "B": 320, "R": 520, "Q": 920, "K": 0}
+# Game phase by the pieces still on the board, 24 with all of them and 0 with only pawns
+phase_weights = {"p": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+max_phase = 24
+
+# fmt: off
+pawn_table = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+pawn_table_eg = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+knight_table = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+]
+bishop_table = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+]
+rook_table = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+]
+queen_table = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+]
+king_table = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+]
+king_table_eg = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+# fmt: on
+tables_mg = {
+    "p": pawn_table,
+    "N": knight_table,
+    "B": bishop_table,
+    "R": rook_table,
+    "Q": queen_table,
+    "K": king_table,
+}
+tables_eg = dict(tables_mg, p=pawn_table_eg, K=king_table_eg)
+
+
+def build_piece_square_values(material, tables):
+    values = {}
+    for piece, table in tables.items():
+        values["w" + piece] = [material[piece] + table[sq] for sq in range(64)]
+        # Mirror the rows for black and count black's material against white
+        values["b" + piece] = [
+            -(material[piece] + table[(7 - sq // 8) * 8 + sq % 8]) for sq in range(64)
+        ]
+    return values
+
+
+# White positive values of a piece on a square, material included
+piece_square_mg = build_piece_square_values(material_mg, tables_mg)
+piece_square_eg = build_piece_square_values(material_eg, tables_eg)
+piece_phase = {
+    color + piece: phase_weights[piece] for color in "wb" for piece in phase_weights
+}
+
+"""
+Move tables built once at import, indexed by [row][col]: the squares a knight or king
+can reach, the squares along each direction in order moving away from the square, and
+the squares a pawn of each color attacks the square from. squares_between holds for
+every pair of squares (row * 8 + col) the squares strictly between them, empty when
+they don't share a line
+"""
+
+directions = (
+    (-1, 0),
+    (0, -1),
+    (1, 0),
+    (0, 1),
+    (-1, -1),
+    (-1, 1),
+    (1, -1),
+    (1, 1),
+)  # Rook directions first, then bishop directions
+knight_steps = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+king_steps = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def build_targets(steps):
+    return [
+        [
+            tuple(
+                (r + dr, c + dc)
+                for dr, dc in steps
+                if 0 <= r + dr < 8 and 0 <= c + dc < 8
+            )
+            for c in range(8)
+        ]
+        for r in range(8)
+    ]
+
+
+def build_rays():
+    return [
+        [
+            tuple(
+                tuple(
+                    (r + dr * i, c + dc * i)
+                    for i in range(1, 8)
+                    if 0 <= r + dr * i < 8 and 0 <= c + dc * i < 8
+                )
+                for dr, dc in directions
+            )
+            for c in range(8)
+        ]
+        for r in range(8)
+    ]
+
+
+def build_squares_between():
+    no_squares = frozenset()
+    between = [[no_squares] * 64 for _ in range(64)]
+    for r in range(8):
+        for c in range(8):
+            for ray in piece_rays[r][c]:
+                for i, (end_row, end_col) in enumerate(ray):
+                    between[r * 8 + c][end_row * 8 + end_col] = frozenset(ray[:i])
+    return between
+
+
+knight_targets = build_targets(knight_steps)
+king_targets = build_targets(king_steps)
+piece_rays = build_rays()
+squares_between = build_squares_between()
+# Squares from which a pawn of the given color attacks a square
+pawn_attackers = {
+    "w": build_targets(((1, -1), (1, 1))),
+    "b": build_targets(((-1, -1), (-1, 1))),
+}
 
 
 class GameState:
@@ -30,66 +269,177 @@ class GameState:
         self.white_king_location = (7, 4)
         self.black_king_location = (0, 4)
         self.in_check = False
-        self.pins = []
+        self.pins = {}
         self.checks = []
         self.checkmate = False
         self.stalemate = False
         self.en_passant_possible = ()  # Square where en passant capture can happen
+        # Plies since the last capture or pawn move, and the number of the current move
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
         # Castling rights
         self.white_castle_king_side = True
         self.white_castle_queen_side = True
         self.black_castle_king_side = True
         self.black_castle_queen_side = True
-        self.castle_rights_log = [
-            CastleRights(
-                self.white_castle_king_side,
-                self.black_castle_king_side,
-                self.white_castle_queen_side,
-                self.black_castle_queen_side,
+        self.undo_stack = array("Q", bytes(16 * undo_stack_plies))
+        self.zobrist_debug = False  # Check the key against a full recomputation
+        self.zobrist_key = self.compute_zobrist_key()
+        self.move_cache = None  # Optional MoveCache for get_valid_moves
+        # Running evaluation, kept up to date by make_move and undo_move
+        self.mg_score, self.eg_score, self.phase = self.compute_evaluation()
+        # Squares of each color's pieces, so generation doesn't walk the empty squares
+        self.piece_squares = self.compute_piece_squares()
+
+    """
+    Set up the position of a FEN string: piece placement, side to move, castling rights,
+    en passant square and move counters. Missing trailing fields take their starting
+    values. The game history starts over from that position
+    """
+
+    def load_fen(self, fen):
+        fields = fen.split()
+        rows = fields[0].split("/") if fields else []
+        board = []
+        for rank in rows:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["  "] * int(char))
+                elif char.upper() in "PRNBQK":
+                    color = "w" if char.isupper() else "b"
+                    row.append(color + (char.upper() if char.upper() != "P" else "p"))
+                else:
+                    raise ValueError("Invalid piece in FEN: " + fen)
+            board.append(row)
+        if len(board) != 8 or any(len(row) != 8 for row in board):
+            raise ValueError("FEN board must have 8 rows of 8 squares: " + fen)
+        self.board = board
+        self.white_to_move = len(fields) < 2 or fields[1] == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        self.white_castle_king_side = "K" in castling
+        self.white_castle_queen_side = "Q" in castling
+        self.black_castle_king_side = "k" in castling
+        self.black_castle_queen_side = "q" in castling
+        en_passant = fields[3] if len(fields) > 3 else "-"
+        if en_passant == "-":
+            self.en_passant_possible = ()
+        else:
+            self.en_passant_possible = (
+                Move.ranks_to_rows[en_passant[1]],
+                Move.files_to_cols[en_passant[0]],
             )
-        ]
+        try:
+            self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("Invalid move counters in FEN: " + fen)
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == "wK":
+                    self.white_king_location = (r, c)
+                elif board[r][c] == "bK":
+                    self.black_king_location = (r, c)
+        self.move_log = []
+        self.in_check = False
+        self.pins = {}
+        self.checks = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobrist_key = self.compute_zobrist_key()
+        if self.move_cache is not None:  # Its moves point at the old board
+            self.move_cache.clear()
+        self.mg_score, self.eg_score, self.phase = self.compute_evaluation()
+        self.piece_squares = self.compute_piece_squares()
+
+    """
+    FEN string of the position, the inverse of load_fen
+    """
+
+    def get_fen(self):
+        rows = []
+        for row in self.board:
+            fen_row = ""
+            empty = 0
+            for square in row:
+                if square == "  ":
+                    empty += 1
+                    continue
+                if empty:
+                    fen_row += str(empty)
+                    empty = 0
+                piece = "P" if square[1] == "p" else square[1]
+                fen_row += piece if square[0] == "w" else piece.lower()
+            if empty:
+                fen_row += str(empty)
+            rows.append(fen_row)
+        castling = (
+            ("K" if self.white_castle_king_side else "")
+            + ("Q" if self.white_castle_queen_side else "")
+            + ("k" if self.black_castle_king_side else "")
+            + ("q" if self.black_castle_queen_side else "")
+        )
+        if self.en_passant_possible == ():
+            en_passant = "-"
+        else:
+            r, c = self.en_passant_possible
+            en_passant = Move.cols_to_files[c] + Move.rows_to_ranks[r]
+        return " ".join(
+            [
+                "/".join(rows),
+                "w" if self.white_to_move else "b",
+                castling if castling else "-",
+                en_passant,
+                str(self.halfmove_clock),
+                str(self.fullmove_number),
+            ]
+        )
 
     """
     Make the move that is passed as a parameter
     """
 
     def make_move(self, move):
+        previous_state_key = self.state_zobrist_key()
+        # Read the lazily derived pieces while the board still has them
+        piece_moved = move.piece_moved
+        piece_captured = move.piece_captured
+        # Save the state the move can't give back by itself
+        self.push_state(piece_captured)
         self.board[move.start_row][move.start_col] = "  "
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        self.board[move.end_row][move.end_col] = piece_moved
         self.move_log.append(move)  # Move logging
         self.white_to_move = not self.white_to_move  # Switching turns
         # Update king's position
-        if move.piece_moved == "wK":
+        if piece_moved == "wK":
             self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
+        elif piece_moved == "bK":
             self.black_king_location = (move.end_row, move.end_col)
         # If pawn moves twice, Next move can capture en passant
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
+        if piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
             self.en_passant_possible = (
                 (move.end_row + move.start_row) // 2,
                 move.end_col,
             )
         else:
             self.en_passant_possible = ()
+        # The fifty-move count starts over on captures and pawn moves
+        if piece_moved[1] == "p" or piece_captured != "  ":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if piece_moved[0] == "b":
+            self.fullmove_number += 1
         # If en passant move, Must update the board to capture the pawn
         if move.en_passant:
             self.board[move.start_row][move.end_col] = "  "
         # If pawn promotion move happened, Change piece
         if move.pawn_promotion:
-            promotioned_piece = input("Promote to Q, R, B or N:")
             self.board[move.end_row][move.end_col] = (
-                move.piece_moved[0] + promotioned_piece
+                piece_moved[0] + move.promotion_piece
             )
         # Update castling rights
         self.update_castle_rights(move)
-        self.castle_rights_log.append(
-            CastleRights(
-                self.white_castle_king_side,
-                self.black_castle_king_side,
-                self.white_castle_queen_side,
-                self.black_castle_queen_side,
-            )
-        )
         # Castle moves
         if move.castle:
             if move.end_col - move.start_col == 2:  # King side castling
@@ -101,11 +451,21 @@ class GameState:
                 ] = "  "  # Empty space where the rook was
             else:  # Queen side castling
                 self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
-                    move.end_col + 1
+                    move.end_col - 2
                 ]  # Move the rook
                 self.board[move.end_row][
                     move.end_col - 2
                 ] = "  "  # Empty space where the rook was
+        placed_piece = self.board[move.end_row][move.end_col]
+        self.zobrist_key ^= (
+            self.move_zobrist_key(move, placed_piece)
+            ^ previous_state_key
+            ^ self.state_zobrist_key()
+        )
+        self.update_evaluation(move, placed_piece, 1)
+        self.update_piece_squares(move, False)
+        if self.zobrist_debug:
+            self.check_zobrist_key()
 
     """
     Undo the last move made
@@ -113,16 +473,21 @@ class GameState:
 
     def undo_move(self):
 
-        if len(self.move_log) != 0:
-
-            move = self.move_log.pop()
-            self.board[move.start_row][
-                move.start_col
-            ] = move.piece_moved  # Put piece on the starting square
-            self.board[move.end_row][
-                move.end_col
-            ] = move.piece_captured  # Put back the captured piece
-            self.white_to_move = not self.white_to_move  # Switching turns
+        if len(self.move_log) == 0:  # Nothing to undo
+            return
+
+        move = self.move_log.pop()
+        ply = len(self.move_log)
+        state = self.undo_stack[2 * ply]
+        piece_captured = piece_names[state >> 8 & 0xF]
+        placed_piece = self.board[move.end_row][move.end_col]
+        self.board[move.start_row][
+            move.start_col
+        ] = move.piece_moved  # Put piece on the starting square
+        self.board[move.end_row][
+            move.end_col
+        ] = piece_captured  # Put back the captured piece
+        self.white_to_move = not self.white_to_move  # Switching turns
 
         # Update king's position
         if move.piece_moved == "wK":
@@ -141,26 +506,18 @@ class GameState:
             ] = "  "  # Remove the pawn that was added in the wrong square
             self.board[move.start_row][
                 move.end_col
-            ] = (
-                move.piece_captured
-            )  # Puts the pawn back on the correct square it was captured from
-            self.en_passant_possible = (
-                move.end_row,
-                move.end_col,
-            )  # Allow an en passant to happen on the next move
-
-        # Undo a 2 square pawn advance should make en_passant_possible = () again
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
+            ] = piece_captured  # Puts the pawn back on the square it was captured from
 
+        # Restore the en passant square, halfmove clock and castling rights
+        en_passant_file = state >> 4 & 0xF
+        if en_passant_file == no_en_passant_file:
             self.en_passant_possible = ()
-
-        # Give back castle rights if move took them away
-        self.castle_rights_log.pop()  # Remove last moves updates
-        CastleRights = self.castle_rights_log[-1]
-        self.white_castle_king_side = CastleRights.wks
-        self.black_castle_king_side = CastleRights.bks
-        self.white_castle_queen_side = CastleRights.wqs
-        self.black_castle_queen_side = CastleRights.bqs
+        else:  # Behind the pawn the other side just pushed
+            self.en_passant_possible = (2 if self.white_to_move else 5, en_passant_file)
+        self.halfmove_clock = state >> 12
+        if move.piece_moved[0] == "b":
+            self.fullmove_number -= 1
+        self.set_castling_rights(state & 0xF)
 
         # Undo castle
         if move.castle:
@@ -181,84 +538,158 @@ class GameState:
                     move.end_col + 1
                 ] = "  "  # Empty the space where the rook was
 
+        self.zobrist_key = self.undo_stack[2 * ply + 1]
+        self.update_evaluation(move, placed_piece, -1)
+        self.update_piece_squares(move, True)
+        if self.zobrist_debug:
+            self.check_zobrist_key()
+
         self.checkmate = False
         self.stalemate = False
 
     """
-    All moves with considering checks
+    Push the state of the position onto the undo stack, at the ply of the move about to
+    be made
     """
 
-    def get_valid_moves(self):
+    def push_state(self, piece_captured):
+        ply = len(self.move_log)
+        undo_stack = self.undo_stack
+        if 2 * ply + 2 > len(undo_stack):  # Deeper than ever before, double the room
+            undo_stack.extend(array("Q", bytes(8 * len(undo_stack))))
+        if self.en_passant_possible == ():
+            en_passant_file = no_en_passant_file
+        else:
+            en_passant_file = self.en_passant_possible[1]
+        undo_stack[2 * ply] = (
+            self.castling_rights()
+            | en_passant_file << 4
+            | piece_codes[piece_captured] << 8
+            | self.halfmove_clock << 12
+        )
+        undo_stack[2 * ply + 1] = self.zobrist_key
 
-        moves = []
-        self.in_check, self.pins, self.checks = self.checking_pins_and_checks()
+    """
+    Pass the turn without moving, for null-move pruning in the search. The null move
+    goes into the move log as None and its state onto the undo stack like any move. The
+    halfmove clock starts over, so no repetition is found across it
+    """
+
+    def make_null_move(self):
+        self.push_state("  ")
+        self.move_log.append(None)
+        if self.en_passant_possible != ():
+            self.zobrist_key ^= zobrist_en_passant[self.en_passant_possible[1]]
+            self.en_passant_possible = ()
+        self.zobrist_key ^= zobrist_black_to_move
+        self.halfmove_clock = 0
+        self.white_to_move = not self.white_to_move
+
+    def undo_null_move(self):
+        self.move_log.pop()
+        ply = len(self.move_log)
+        state = self.undo_stack[2 * ply]
+        self.white_to_move = not self.white_to_move
+        en_passant_file = state >> 4 & 0xF
+        if en_passant_file != no_en_passant_file:
+            self.en_passant_possible = (2 if self.white_to_move else 5, en_passant_file)
+        self.halfmove_clock = state >> 12
+        self.zobrist_key = self.undo_stack[2 * ply + 1]
+        self.checkmate = False
+        self.stalemate = False
+
+    """
+    Is the side to move in check, without generating any moves
+    """
 
+    def king_in_check(self):
         if self.white_to_move:
+            return self.square_under_attack(*self.white_king_location)
+        return self.square_under_attack(*self.black_king_location)
 
-            king_row = self.white_king_location[0]
-            king_col = self.white_king_location[1]
+    """
+    Does the side to move have a piece other than pawns and the king. Without one,
+    passing can be the best move (zugzwang) and a null move tells the search nothing
+    """
 
-        else:
+    def has_non_pawn_material(self):
+        board = self.board
+        color = "w" if self.white_to_move else "b"
+        for r, c in self.piece_squares[color]:
+            if board[r][c][1] not in "pK":
+                return True
+        return False
 
-            king_row = self.black_king_location[0]
-            king_col = self.black_king_location[1]
+    """
+    Has the position been on the board before, with the same side to move, since the
+    last capture or pawn move. The keys of the earlier positions are on the undo stack
+    """
 
-        if self.in_check:
+    def is_repetition(self):
+        ply = len(self.move_log)
+        key = self.zobrist_key
+        undo_stack = self.undo_stack
+        oldest = max(ply - self.halfmove_clock, 0)
+        for earlier in range(ply - 4, oldest - 1, -2):
+            if undo_stack[2 * earlier + 1] == key:
+                return True
+        return False
 
-            if len(self.checks) == 1:  # Only 1 check, Block the check or move the king
+    """
+    Drawn by a repeated position or by the fifty-move rule. A mate on the hundredth ply
+    is still a mate, so only then are the moves generated
+    """
 
-                moves = self.get_all_possible_moves()
-                # To block a check you must move a piece in between the enemy piece and the king
-                check = self.checks[0]  # Check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][
-                    check_col
-                ]  # Enemy piece causing the check
-                valid_squares = []  # Squares that pieces can move to
+    def is_draw(self):
+        if self.halfmove_clock >= 100:
+            return len(self.get_valid_moves()) != 0 or not self.in_check
+        return self.is_repetition()
 
-                # If knight , Must capture the knight or move the king, But other pieces can be blocked
-                if piece_checking[1] == "N":
+    """
+    All moves with considering checks
+    """
 
-                    valid_squares = [(check_row, check_col)]
+    def get_valid_moves(self, stage=all_moves):
 
-                else:
+        if stage == all_moves and self.move_cache is not None:
+            cached = self.cached_valid_moves()
+            if cached is not None:
+                return cached
 
-                    for i in range(1, 8):
+        moves = []
+        self.in_check, self.pins, self.checks = self.checking_pins_and_checks()
 
-                        valid_square = (
-                            king_row + check[2] * i,
-                            king_col + check[3] * i,
-                        )  # Check[2] and check[3] are check directions
-                        valid_squares.append(valid_square)
+        if self.white_to_move:
 
-                        if (
-                            valid_square[0] == check_row
-                            and valid_square[1] == check_col
-                        ):  # Once you get to piece end checks
+            king_row = self.white_king_location[0]
+            king_col = self.white_king_location[1]
 
-                            break
+        else:
 
-                # Get ride of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # Going backwards when removing
+            king_row = self.black_king_location[0]
+            king_col = self.black_king_location[1]
 
-                    if (
-                        moves[i].piece_moved[1] != "K"
-                    ):  # Move doesn't move the king so it must block check or capture piece
+        if self.in_check:
 
-                        if (
-                            not (moves[i].end_row, moves[i].end_col) in valid_squares
-                        ):  # Moves doesn't block check or capture piece
+            if len(self.checks) == 1:  # Only 1 check, Block the check or move the king
 
-                            moves.remove(moves[i])
+                moves = self.get_check_evasions(
+                    self.get_all_possible_moves(stage), king_row, king_col
+                )
 
             else:  # Double check, King has to move
 
-                self.get_kings_move(king_row, king_col, moves)
+                self.get_kings_move(king_row, king_col, moves, stage)
 
         else:  # Not in check so all moves are fine
 
-            moves = self.get_all_possible_moves()
+            moves = self.get_all_possible_moves(stage)
+            if stage != capture_moves:
+                self.get_castle_moves(king_row, king_col, moves)
+
+        if stage != all_moves:  # Only part of the moves, can't tell mate from it
+
+            return moves
 
         if len(moves) == 0:
 
@@ -275,22 +706,88 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+        if self.move_cache is not None:
+            self.move_cache.put(self.zobrist_key, moves, self.in_check)
+
         return moves
 
+    """
+    The legal moves of the position from the move cache, as a new list the caller may
+    change, or None when it isn't cached. Sets in_check, checkmate and stalemate like
+    get_valid_moves does
+    """
+
+    def cached_valid_moves(self):
+        entry = self.move_cache.get(self.zobrist_key)
+        if entry is None:
+            return None
+        moves, self.in_check = entry
+        self.checkmate = self.in_check and not moves
+        self.stalemate = not self.in_check and not moves
+        return list(moves)
+
+    """
+    Single check: keep king moves and moves that block the check or capture the checker
+    """
+
+    def get_check_evasions(self, moves, king_row, king_col):
+        check = self.checks[0]  # Check information
+        check_row = check[0]
+        check_col = check[1]
+        # Squares between the king and the checker, none for a knight or adjacent piece
+        between = squares_between[king_row * 8 + king_col][check_row * 8 + check_col]
+        valid_squares = between | {(check_row, check_col)}
+        # En passant takes the checker off a square the capturing pawn doesn't land on
+        return [
+            move
+            for move in moves
+            if (move.end_row, move.end_col) in valid_squares
+            or (move.start_row == king_row and move.start_col == king_col)
+            or (
+                move.en_passant
+                and move.start_row == check_row
+                and move.end_col == check_col
+            )
+        ]
+
+    """
+    The legal move with the given move_id, or None. Only the moving piece's moves are
+    generated, so a hash or killer move can be tried before generating the rest
+    """
+
+    def get_legal_move(self, move_id):
+        start_row, start_col = divmod(move_id & 0x3F, 8)
+        piece = self.board[start_row][start_col]
+        if piece[0] != ("w" if self.white_to_move else "b"):
+            return None
+        self.in_check, self.pins, self.checks = self.checking_pins_and_checks()
+        if len(self.checks) > 1 and piece[1] != "K":  # Double check, King has to move
+            return None
+        moves = []
+        self.move_functions[piece[1]](start_row, start_col, moves)
+        if piece[1] == "K" and not self.in_check:
+            self.get_castle_moves(start_row, start_col, moves)
+        if len(self.checks) == 1:
+            if self.white_to_move:
+                king_row, king_col = self.white_king_location
+            else:
+                king_row, king_col = self.black_king_location
+            moves = self.get_check_evasions(moves, king_row, king_col)
+        for move in moves:
+            if move.move_id == move_id:
+                return move
+        return None
+
     """
     All moves without considering checks
     """
 
-    def get_all_possible_moves(self):
+    def get_all_possible_moves(self, stage=all_moves):
         moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if (turn == "w" and self.white_to_move) or (
-                    turn == "b" and not self.white_to_move
-                ):
-                    piece = self.board[r][c][1]
-                    self.move_functions[piece](r, c, moves)
+        turn = "w" if self.white_to_move else "b"
+        for r, c in self.piece_squares[turn]:  # Only the side to move's pieces
+            piece = self.board[r][c][1]
+            self.move_functions[piece](r, c, moves, stage)
 
         return moves
 
@@ -298,15 +795,9 @@ class GameState:
     Pawn moves
     """
 
-    def get_pawn_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+    def get_pawn_moves(self, r, c, moves, stage=all_moves):
+        pin_direction = self.pins.get((r, c))
+        piece_pinned = pin_direction is not None
 
         if self.white_to_move:
 
@@ -322,209 +813,258 @@ class GameState:
             back_row = 7
             enemy_color = "w"
 
-        pawn_promotion = False
+        pawn_promotion = r + move_amount == back_row  # Reaching the back row promotes
 
         if self.board[r + move_amount][c] == "  ":  # 1 square advance
 
-            if not piece_pinned or pin_direction == (move_amount, 0):
+            # A pin along the file still lets the pawn move
+            if not piece_pinned or pin_direction in (
+                (move_amount, 0),
+                (-move_amount, 0),
+            ):
 
-                if (
-                    r + move_amount == back_row
-                ):  # If piece gets to back row then it's pawn promotion
-
-                    pawn_promotion = True
+                # A promoting push belongs with the captures
+                if stage == all_moves or (stage == capture_moves) == pawn_promotion:
 
-                moves.append(
-                    Move(
-                        (r, c),
-                        (r + move_amount, c),
-                        self.board,
-                        pawn_promotion=pawn_promotion,
+                    self.add_pawn_move(
+                        (r, c), (r + move_amount, c), pawn_promotion, moves
                     )
-                )
 
                 if (
-                    r == start_row and self.board[r + 2 * move_amount][c] == "  "
+                    r == start_row
+                    and stage != capture_moves
+                    and self.board[r + 2 * move_amount][c] == "  "
                 ):  # 2 square advance
 
                     moves.append(Move((r, c), (r + 2 * move_amount, c), self.board))
 
-        if c - 1 >= 0:  # Capture to left
-            if not piece_pinned or pin_direction(move_amount, 1):
+        if stage == quiet_moves:
+            return
 
-                if self.board[r + move_amount][c - 1][0] == enemy_color:
+        for dc in (-1, 1):  # Capture to left and right
+            if not 0 <= c + dc <= 7:
+                continue
+            # A pin along the capture diagonal still lets the pawn capture
+            if piece_pinned and pin_direction not in (
+                (move_amount, dc),
+                (-move_amount, -dc),
+            ):
+                continue
 
-                    if r + move_amount == back_row:
+            if self.board[r + move_amount][c + dc][0] == enemy_color:
 
-                        pawn_promotion = True
+                self.add_pawn_move(
+                    (r, c), (r + move_amount, c + dc), pawn_promotion, moves
+                )
 
-                    moves.append(
-                        Move(
-                            (r, c),
-                            (r + move_amount, c - 1),
-                            self.board,
-                            pawn_promotion=pawn_promotion,
-                        )
-                    )
+            if (r + move_amount, c + dc) == self.en_passant_possible:
 
-                if (r + move_amount, c - 1) == self.en_passant_possible:
+                if not self.en_passant_exposes_king(r, c, c + dc):
 
                     moves.append(
                         Move(
                             (r, c),
-                            (r + move_amount, c - 1),
+                            (r + move_amount, c + dc),
                             self.board,
                             en_passant=True,
                         )
                     )
 
-        if c + 1 <= 7:  # Capture to right
-            if not piece_pinned or pin_direction(move_amount, -1):
-
-                if self.board[r + move_amount][c + 1][0] == enemy_color:
-
-                    if r + move_amount == back_row:
-
-                        pawn_promotion = True
+    """
+    Add a pawn move, or one move for each piece when it promotes
+    """
 
-                    moves.append(
-                        Move(
-                            (r, c),
-                            (r + move_amount, c + 1),
-                            self.board,
-                            pawn_promotion=pawn_promotion,
-                        )
+    def add_pawn_move(self, start_sq, end_sq, pawn_promotion, moves):
+        if pawn_promotion:
+            for piece in promotion_pieces:
+                moves.append(
+                    Move(
+                        start_sq,
+                        end_sq,
+                        self.board,
+                        pawn_promotion=True,
+                        promotion_piece=piece,
                     )
+                )
+        else:
+            moves.append(Move(start_sq, end_sq, self.board))
 
-                if (r + move_amount, c + 1) == self.en_passant_possible:
+    """
+    En passant takes two pawns off the same row at once, which can open that row to an
+    enemy rook or queen even though neither pawn was pinned on its own
+    """
 
-                    moves.append(
-                        Move(
-                            (r, c),
-                            (r + move_amount, c + 1),
-                            self.board,
-                            en_passant=True,
-                        )
-                    )
+    def en_passant_exposes_king(self, r, c, captured_col):
+        if self.white_to_move:
+            king_row, king_col = self.white_king_location
+            enemy_color = "b"
+        else:
+            king_row, king_col = self.black_king_location
+            enemy_color = "w"
+        if king_row != r:
+            return False
+        step = 1 if king_col < c else -1
+        col = king_col + step
+        while 0 <= col < 8:
+            if col != c and col != captured_col:
+                square = self.board[r][col]
+                if square != "  ":
+                    return square[0] == enemy_color and square[1] in ("R", "Q")
+            col += step
+        return False
 
     """
     Rook moves
     """
 
-    def get_rook_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != "Q":
-                    self.pins.remove(self.pins[i])
-                break
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
+    def get_rook_moves(self, r, c, moves, stage=all_moves):
+        pin_direction = self.pins.get((r, c))
+        piece_pinned = pin_direction is not None
+        self.get_slider_moves(r, c, 0, 4, piece_pinned, pin_direction, moves, stage)
+
+    """
+    Rook (directions 0 to 3) and bishop (directions 4 to 7) moves along the precomputed
+    rays
+    """
+
+    def get_slider_moves(
+        self, r, c, first, last, piece_pinned, pin_direction, moves, stage=all_moves
+    ):
         enemycolor = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if (
-                        not piece_pinned
-                        or pin_direction == d
-                        or pin_direction == (-d[0], -d[1])
-                    ):
-                        endpiece = self.board[end_row][end_col]
-                        if endpiece == "  ":
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif endpiece[0] == enemycolor:
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
+        board = self.board
+        rays = piece_rays[r][c]
+        for j in range(first, last):
+            d = directions[j]
+            if piece_pinned and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue
+            for end_row, end_col in rays[j]:
+                endpiece = board[end_row][end_col]
+                if endpiece == "  ":
+                    if stage != capture_moves:
+                        moves.append(Move((r, c), (end_row, end_col), board))
+                elif endpiece[0] == enemycolor:
+                    if stage != quiet_moves:
+                        moves.append(Move((r, c), (end_row, end_col), board))
+                    break
                 else:
                     break
 
-    def getknightmoves(self, r, c, moves):
-        piece_pinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-        knightmoves = (
-            (-2, -1),
-            (-2, 1),
-            (-1, -2),
-            (-1, 2),
-            (1, -2),
-            (1, 2),
-            (2, -1),
-            (2, 1),
-        )
+    def getknightmoves(self, r, c, moves, stage=all_moves):
+        if (r, c) in self.pins:  # A pinned knight can never stay on the pin line
+            return
         allycolor = "w" if self.white_to_move else "b"
-        for m in knightmoves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not piece_pinned:
-                    endpiece = self.board[end_row][end_col]
-                    if endpiece[0] != allycolor:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-
-    def get_bishop_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        for end_row, end_col in knight_targets[r][c]:
+            endpiece = self.board[end_row][end_col]
+            if endpiece == "  ":
+                if stage == capture_moves:
+                    continue
+            elif endpiece[0] == allycolor or stage == quiet_moves:
+                continue
+            moves.append(Move((r, c), (end_row, end_col), self.board))
+
+    def get_bishop_moves(self, r, c, moves, stage=all_moves):
+        pin_direction = self.pins.get((r, c))
+        piece_pinned = pin_direction is not None
+        self.get_slider_moves(r, c, 4, 8, piece_pinned, pin_direction, moves, stage)
+
+    def get_queen_moves(self, r, c, moves, stage=all_moves):
+        self.get_bishop_moves(r, c, moves, stage)
+        self.get_rook_moves(r, c, moves, stage)
+
+    def get_kings_move(self, r, c, moves, stage=all_moves):
+        allycolor = "w" if self.white_to_move else "b"
+        for end_row, end_col in king_targets[r][c]:
+            endpiece = self.board[end_row][end_col]
+            if endpiece == "  ":
+                if stage == capture_moves:
+                    continue
+            elif endpiece[0] == allycolor or stage == quiet_moves:
+                continue
+            if not self.king_square_attacked(r, c, end_row, end_col):
+                moves.append(Move((r, c), (end_row, end_col), self.board))
+
+    """
+    Would the king standing on (r, c) be attacked on (end_row, end_col). The king is
+    lifted off its square first so that it can't shield the square behind it from a
+    slider
+    """
+
+    def king_square_attacked(self, r, c, end_row, end_col):
+        king = self.board[r][c]
+        self.board[r][c] = "  "
+        attacked = self.square_under_attack(end_row, end_col)
+        self.board[r][c] = king
+        return attacked
+
+    """
+    Is the square attacked by the side not to move, looked up from the square outwards
+    with the knight, king and pawn tables and along the rays for sliders
+    """
+
+    def square_under_attack(self, r, c):
         enemycolor = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piece_pinned:
-                        endpiece = self.board[end_row][end_col]
-                        if endpiece == "  ":
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif endpiece[0] == enemycolor:
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
+        board = self.board
+        for end_row, end_col in knight_targets[r][c]:
+            if board[end_row][end_col] == enemycolor + "N":
+                return True
+        for end_row, end_col in pawn_attackers[enemycolor][r][c]:
+            if board[end_row][end_col] == enemycolor + "p":
+                return True
+        for end_row, end_col in king_targets[r][c]:
+            if board[end_row][end_col] == enemycolor + "K":
+                return True
+        rays = piece_rays[r][c]
+        for j in range(8):
+            slider = "R" if j < 4 else "B"
+            for end_row, end_col in rays[j]:
+                endpiece = board[end_row][end_col]
+                if endpiece != "  ":
+                    if endpiece[0] == enemycolor and (
+                        endpiece[1] == slider or endpiece[1] == "Q"
+                    ):
+                        return True
                     break
+        return False
 
-    def get_queen_moves(self, r, c, moves):
-        self.get_bishop_moves(r, c, moves)
-        self.get_rook_moves(r, c, moves)
-
-    def get_kings_move(self, r, c, moves):
-        kingmoves = (
-            (-1, -1),
-            (-1, 0),
-            (-1, 1),
-            (0, -1),
-            (0, 1),
-            (1, -1),
-            (1, 0),
-            (1, 1),
-        )
-        allycolor = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = r + kingmoves[i][0]
-            end_col = c + kingmoves[i][1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                endpiece = self.board[end_row][end_col]
-                if endpiece[0] != allycolor:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
+    """
+    Castling moves, the king may not be in check or pass through or land on an attacked
+    square
+    """
+
+    def get_castle_moves(self, r, c, moves):
+        if self.square_under_attack(r, c):
+            return
+        if self.white_to_move:
+            king_side = self.white_castle_king_side
+            queen_side = self.white_castle_queen_side
+        else:
+            king_side = self.black_castle_king_side
+            queen_side = self.black_castle_queen_side
+        if (
+            king_side
+            and self.board[r][c + 1] == "  "
+            and self.board[r][c + 2] == "  "
+            and not self.square_under_attack(r, c + 1)
+            and not self.square_under_attack(r, c + 2)
+        ):
+            moves.append(Move((r, c), (r, c + 2), self.board, castle=True))
+        if (
+            queen_side
+            and self.board[r][c - 1] == "  "
+            and self.board[r][c - 2] == "  "
+            and self.board[r][c - 3] == "  "
+            and not self.square_under_attack(r, c - 1)
+            and not self.square_under_attack(r, c - 2)
+        ):
+            moves.append(Move((r, c), (r, c - 2), self.board, castle=True))
+
+    """
+    Checks against the side to move's king, and its pinned pieces as a map from the
+    pinned piece's square to the direction from the king to it
+    """
 
     def checking_pins_and_checks(self):
-        pins = []
+        pins = {}
         checks = []
         in_check = False
         if self.white_to_move:
@@ -537,87 +1077,252 @@ class GameState:
             allycolor = "b"
             start_row = self.black_king_location[0]
             start_col = self.black_king_location[1]
-        directions = (
-            (-1, 0),
-            (0, -1),
-            (1, 0),
-            (0, 1),
-            (-1, -1),
-            (-1, 1),
-            (1, -1),
-            (1, 1),
-        )
-        for j in range(len(directions)):
+        board = self.board
+        rays = piece_rays[start_row][start_col]
+        for j in range(8):
             d = directions[j]
             possiblepin = ()
-            for i in range(1, 8):
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    endpiece = self.board[end_row][end_col]
-                    if endpiece[0] == allycolor:
+            i = 0
+            for end_row, end_col in rays[j]:
+                i += 1
+                endpiece = board[end_row][end_col]
+                if endpiece[0] == allycolor:
+                    if possiblepin == ():
+                        possiblepin = (end_row, end_col)
+                    else:
+                        break
+                elif endpiece[0] == enemycolor:
+                    type = endpiece[1]
+                    if (
+                        (0 <= j <= 3 and type == "R")
+                        or (4 <= j <= 7 and type == "B")
+                        or (
+                            i == 1
+                            and type == "p"
+                            and (
+                                (enemycolor == "w" and 6 <= j <= 7)
+                                or (enemycolor == "b" and 4 <= j <= 5)
+                            )
+                        )
+                        or (type == "Q")
+                        or (i == 1 and type == "K")
+                    ):
                         if possiblepin == ():
-                            possiblepin = (end_row, end_col, d[0], d[1])
-                        else:
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
                             break
-                    elif endpiece[0] == enemycolor:
-                        type = endpiece[1]
-                        if (
-                            (0 <= j <= 3 and type == "R")
-                            or (4 <= j <= 7 and type == "B")
-                            or (
-                                i == 1
-                                and type == "p"
-                                and (
-                                    (enemycolor == "w" and 6 <= j <= 7)
-                                    or (enemycolor == "b" and 4 <= j <= 5)
-                                )
-                            )
-                            or (type == "Q")
-                            or (i == 1 and type == "K")
-                        ):
-                            if possiblepin == ():
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possiblepin)
-                                break
                         else:
+                            pins[possiblepin] = d
                             break
-                else:
-                    break
-        knightmoves = (
-            (-2, -1),
-            (-2, 1),
-            (-1, -2),
-            (-1, 2),
-            (1, -2),
-            (1, 2),
-            (2, -1),
-            (2, 1),
-        )
-        for m in knightmoves:
-            end_row = start_row + m[0]
-            end_col = start_col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                endpiece = self.board[end_row][end_col]
-                if endpiece[0] == enemycolor and endpiece[1] == "N":
-                    in_check = True
-                    checks.append((end_row, end_col, m[0], m[1]))
+                    else:
+                        break
+        for end_row, end_col in knight_targets[start_row][start_col]:
+            endpiece = board[end_row][end_col]
+            if endpiece[0] == enemycolor and endpiece[1] == "N":
+                in_check = True
+                checks.append(
+                    (end_row, end_col, end_row - start_row, end_col - start_col)
+                )
         return in_check, pins, checks
 
+    """
+    Moving the king or a rook, or losing a rook on its starting square, loses castling
+    rights
+    """
+
     def update_castle_rights(self, move):
-        pass
+        if move.piece_moved == "wK":
+            self.white_castle_king_side = False
+            self.white_castle_queen_side = False
+        elif move.piece_moved == "bK":
+            self.black_castle_king_side = False
+            self.black_castle_queen_side = False
+        for row, col in (
+            (move.start_row, move.start_col),
+            (move.end_row, move.end_col),
+        ):
+            if (row, col) == (7, 0):
+                self.white_castle_queen_side = False
+            elif (row, col) == (7, 7):
+                self.white_castle_king_side = False
+            elif (row, col) == (0, 0):
+                self.black_castle_queen_side = False
+            elif (row, col) == (0, 7):
+                self.black_castle_king_side = False
 
+    """
+    The four castling rights as bits: white king side 1, white queen side 2, black king
+    side 4, black queen side 8
+    """
 
-class CastleRights:
+    def castling_rights(self):
+        return (
+            self.white_castle_king_side
+            | self.white_castle_queen_side << 1
+            | self.black_castle_king_side << 2
+            | self.black_castle_queen_side << 3
+        )
+
+    def set_castling_rights(self, rights):
+        self.white_castle_king_side = rights & 1 != 0
+        self.white_castle_queen_side = rights & 2 != 0
+        self.black_castle_king_side = rights & 4 != 0
+        self.black_castle_queen_side = rights & 8 != 0
+
+    """
+    Zobrist key of everything except the pieces: side to move, castling rights and the
+    en passant file
+    """
+
+    def state_zobrist_key(self):
+        key = zobrist_castling[self.castling_rights()]
+        if self.en_passant_possible != ():
+            key ^= zobrist_en_passant[self.en_passant_possible[1]]
+        if not self.white_to_move:
+            key ^= zobrist_black_to_move
+        return key
+
+    """
+    Zobrist key of the pieces a move changes, XOR it in to make the move and again to
+    undo it
+    """
+
+    def move_zobrist_key(self, move, placed_piece):
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        key = zobrist_pieces[move.piece_moved][start]
+        key ^= zobrist_pieces[placed_piece][end]
+        if move.piece_captured != "  ":
+            captured_sq = end
+            if move.en_passant:  # The captured pawn stands beside the start square
+                captured_sq = move.start_row * 8 + move.end_col
+            key ^= zobrist_pieces[move.piece_captured][captured_sq]
+        if move.castle:
+            rook = move.piece_moved[0] + "R"
+            if move.end_col - move.start_col == 2:  # King side
+                key ^= zobrist_pieces[rook][end + 1] ^ zobrist_pieces[rook][end - 1]
+            else:  # Queen side
+                key ^= zobrist_pieces[rook][end - 2] ^ zobrist_pieces[rook][end + 1]
+        return key
 
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+    """
+    Zobrist key computed from scratch, used at start up and by the debug check
+    """
+
+    def compute_zobrist_key(self):
+        key = self.state_zobrist_key()
+        for r in range(8):
+            for c in range(8):
+                square = self.board[r][c]
+                if square != "  ":
+                    key ^= zobrist_pieces[square][r * 8 + c]
+        return key
+
+    """
+    Add (sign 1) or take back (sign -1) the change a move makes to the running
+    evaluation
+    """
+
+    def update_evaluation(self, move, placed_piece, sign):
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        piece_moved = move.piece_moved
+        mg = piece_square_mg[placed_piece][end] - piece_square_mg[piece_moved][start]
+        eg = piece_square_eg[placed_piece][end] - piece_square_eg[piece_moved][start]
+        phase = piece_phase[placed_piece] - piece_phase[piece_moved]  # Promotions
+        captured = move.piece_captured
+        if captured != "  ":
+            if move.en_passant:
+                captured_sq = move.start_row * 8 + move.end_col
+            else:
+                captured_sq = end
+            mg -= piece_square_mg[captured][captured_sq]
+            eg -= piece_square_eg[captured][captured_sq]
+            phase -= piece_phase[captured]
+        if move.castle:
+            rook = piece_moved[0] + "R"
+            if move.end_col - move.start_col == 2:  # King side
+                rook_start, rook_end = end + 1, end - 1
+            else:  # Queen side
+                rook_start, rook_end = end - 2, end + 1
+            mg += piece_square_mg[rook][rook_end] - piece_square_mg[rook][rook_start]
+            eg += piece_square_eg[rook][rook_end] - piece_square_eg[rook][rook_start]
+        self.mg_score += sign * mg
+        self.eg_score += sign * eg
+        self.phase += sign * phase
+
+    """
+    Move the piece (and the castling rook) in the piece lists and take out or put back
+    the captured piece
+    """
+
+    def update_piece_squares(self, move, undo):
+        start = (move.start_row, move.start_col)
+        end = (move.end_row, move.end_col)
+        allies = self.piece_squares[move.piece_moved[0]]
+        if undo:
+            start, end = end, start
+        allies.remove(start)
+        allies.add(end)
+        captured = move.piece_captured
+        if captured != "  ":
+            if move.en_passant:
+                captured_sq = (move.start_row, move.end_col)
+            else:
+                captured_sq = (move.end_row, move.end_col)
+            if undo:
+                self.piece_squares[captured[0]].add(captured_sq)
+            else:
+                self.piece_squares[captured[0]].remove(captured_sq)
+        if move.castle:
+            if move.end_col - move.start_col == 2:  # King side
+                rook_start_col, rook_end_col = move.end_col + 1, move.end_col - 1
+            else:  # Queen side
+                rook_start_col, rook_end_col = move.end_col - 2, move.end_col + 1
+            rook_start = (move.end_row, rook_start_col)
+            rook_end = (move.end_row, rook_end_col)
+            if undo:
+                rook_start, rook_end = rook_end, rook_start
+            allies.remove(rook_start)
+            allies.add(rook_end)
+
+    def compute_piece_squares(self):
+        piece_squares = {"w": set(), "b": set()}
+        for r in range(8):
+            for c in range(8):
+                square = self.board[r][c]
+                if square != "  ":
+                    piece_squares[square[0]].add((r, c))
+        return piece_squares
+
+    """
+    Middlegame score, endgame score and phase computed from scratch
+    """
+
+    def compute_evaluation(self):
+        mg = eg = phase = 0
+        for r in range(8):
+            for c in range(8):
+                square = self.board[r][c]
+                if square != "  ":
+                    mg += piece_square_mg[square][r * 8 + c]
+                    eg += piece_square_eg[square][r * 8 + c]
+                    phase += piece_phase[square]
+        return mg, eg, phase
+
+    """
+    Static evaluation in centipawns from white's side, the middlegame and endgame scores
+    blended by how much material is left (tapered evaluation)
+    """
+
+    def evaluate(self):
+        phase = min(self.phase, max_phase)
+        score = self.mg_score * phase + self.eg_score * (max_phase - phase)
+        return score // max_phase
+
+    def check_zobrist_key(self):
+        if self.zobrist_key != self.compute_zobrist_key():
+            raise RuntimeError("Zobrist key out of sync with the position")
 
 
 class Move:
@@ -645,6 +1350,30 @@ class Move:
     }
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
+    """
+    Moves are created by the thousand and most are never played, so they keep only what
+    the generator already knows: the squares, the special move flags, the piece a pawn
+    promotes to and a 16-bit move_id (from square | to square << 6 | promotion code
+    << 12, squares numbered row * 8 + col). The moved and captured pieces are read off
+    the board the first time they're asked for, make_move does that before it changes
+    the board
+    """
+
+    __slots__ = (
+        "start_row",
+        "start_col",
+        "end_row",
+        "end_col",
+        "en_passant",
+        "pawn_promotion",
+        "promotion_piece",
+        "castle",
+        "move_id",
+        "board",
+        "_piece_moved",
+        "_piece_captured",
+    )
+
     def __init__(
         self,
         start_sq,
@@ -653,30 +1382,46 @@ class Move:
         en_passant=False,
         pawn_promotion=False,
         castle=False,
+        promotion_piece="Q",
     ):
 
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+        self.start_row, self.start_col = start_sq
+        self.end_row, self.end_col = end_sq
+        self.board = board
         self.en_passant = en_passant
         self.pawn_promotion = pawn_promotion
         self.castle = castle
-
-        if en_passant:
-
-            self.piece_captured = (
-                "bp" if self.piece_moved == "wp" else "wp"
-            )  # En passant captures the opposite colored pawn
-
         self.move_id = (
-            self.start_row * 1000
-            + self.start_col * 100
-            + self.end_row * 10
-            + self.end_col
+            self.start_row * 8 + self.start_col | (self.end_row * 8 + self.end_col) << 6
         )
+        if pawn_promotion:
+            self.promotion_piece = promotion_piece
+            self.move_id |= promotion_codes[promotion_piece] << 12
+        else:
+            self.promotion_piece = ""
+
+    # The piece slots stay unset until first read, which keeps the constructor short
+
+    @property
+    def piece_moved(self):
+        try:
+            return self._piece_moved
+        except AttributeError:
+            self._piece_moved = self.board[self.start_row][self.start_col]
+            return self._piece_moved
+
+    @property
+    def piece_captured(self):
+        try:
+            return self._piece_captured
+        except AttributeError:
+            if self.en_passant:
+                self._piece_captured = (
+                    "bp" if self.piece_moved == "wp" else "wp"
+                )  # En passant captures the opposite colored pawn
+            else:
+                self._piece_captured = self.board[self.end_row][self.end_col]
+            return self._piece_captured
 
     """
     Override the equals method
@@ -690,10 +1435,15 @@ class Move:
 
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     def get_chess_notation(self):
 
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(
-            self.end_row, self.end_col
+        return (
+            self.get_rank_file(self.start_row, self.start_col)
+            + self.get_rank_file(self.end_row, self.end_col)
+            + self.promotion_piece.lower()
         )
 
     def get_rank_file(self, r, c):
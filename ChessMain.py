@@ -1,13 +1,30 @@
+import os
+import queue
+import threading
+import time
+
 import pygame as p
 import Images
 import ChessEngine
+import ParallelSearch
+from Bitbases import Bitbases
+from MoveCache import MoveCache
+from OpeningBook import OpeningBook
 import SmartMoveFinder
+from TranspositionTable import TranspositionTable
 
 
 width = height = 512
 dimension = 8
 sq_size = height // dimension
 max_fps = 15
+tt_size_mb = 32  # Memory for the AI's transposition table
+ai_time_limit_ms = 2000  # Thinking time per AI move
+ai_workers = 0  # Processes for the root-parallel search, 0 searches in this process
+ai_ponder = True  # Search the expected reply while the player thinks
+opening_book_path = "book.bin"  # Made by OpeningBook.py, not used when missing
+bitbases_path = "bitbases.bin"  # Made by Bitbases.py, not used when missing
+move_cache_size = 256  # Positions of the game whose legal moves are kept for undo
 Images = {}
 
 
@@ -25,6 +42,7 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameState()
+    gs.move_cache = MoveCache(move_cache_size)
     valid_moves = gs.get_valid_moves()
     move_made = False  # Flag variable for when a move is made
     animate = False  # Flag variable for when we should animate a move
@@ -35,12 +53,26 @@ def main():
     game_over = False
     player_one = True
     player_two = False
+    # Kept for the whole session, also across resets
+    tt = TranspositionTable(tt_size_mb)
+    executor = ParallelSearch.new_executor(ai_workers) if ai_workers else None
+    book = None
+    if os.path.exists(opening_book_path):
+        book = OpeningBook(opening_book_path)
+    bitbases = Bitbases(bitbases_path) if os.path.exists(bitbases_path) else None
+    ai_results = queue.Queue()  # Moves found by the background search
+    ai_search = None  # (thread, cancel event) of the search in progress
+    ponder_move_id = 0  # Reply the running ponder search expects, 0 when not pondering
+    ai_deadline = None  # When a ponder search that was hit has to stop
+    ponder_start = None  # When the running ponder search started
     while running:
         human_turn = (gs.white_to_move and player_one) or (
             not gs.white_to_move and player_two
         )
         for e in p.event.get():
             if e.type == p.QUIT:
+                ai_search = stop_ai_search(ai_search)
+                ponder_move_id = 0
                 running = False
             # Mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
@@ -60,39 +92,99 @@ def main():
                             player_clicks[0], player_clicks[1], gs.board
                         )
                         print(move.get_chess_notation())
-                        if move in valid_moves:
-                            gs.make_move(move)
-                            move_made = True
-                            animate = True
-                            sq_selected = ()
-                            player_clicks = []
+                        for valid_move in valid_moves:
+                            # The clicks don't say the promotion piece, only the squares
+                            if valid_move.move_id & 0xFFF == move.move_id:
+                                if valid_move.pawn_promotion:
+                                    valid_move = choose_promotion(
+                                        screen, clock, valid_moves, valid_move
+                                    )
+                                    if valid_move is None:  # Clicked elsewhere
+                                        sq_selected = ()
+                                        player_clicks = []
+                                        break
+                                # The generated move carries the special move flags
+                                gs.make_move(valid_move)
+                                if ponder_move_id:
+                                    if valid_move.move_id == ponder_move_id:
+                                        # Ponder hit, the time spent pondering counts
+                                        ai_deadline = ponder_start
+                                        ai_deadline += ai_time_limit_ms / 1000
+                                        if time.perf_counter() >= ai_deadline:
+                                            # Already used up, report the move now
+                                            ai_search[1].set()
+                                            ai_deadline = None
+                                    else:
+                                        ai_search = stop_ai_search(ai_search)
+                                    ponder_move_id = 0
+                                move_made = True
+                                animate = True
+                                sq_selected = ()
+                                player_clicks = []
+                                break
                         else:
                             player_clicks = [sq_selected]
             # Key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # Undo when 'z' is pressed
+                    ai_search = stop_ai_search(ai_search)
+                    ponder_move_id = 0
+                    ai_deadline = None
                     gs.undo_move()
                     move_made = True
                     animate = False
                     game_over = False
 
                 if e.key == p.K_r:  # Reset the game when 'r' is pressed
+                    ai_search = stop_ai_search(ai_search)
+                    ponder_move_id = 0
+                    ai_deadline = None
                     gs = ChessEngine.GameState()
-                    valid_moves = gs.get_valid_moves
+                    gs.move_cache = MoveCache(move_cache_size)
+                    valid_moves = gs.get_valid_moves()
                     sq_selected = ()
                     player_clicks = []
                     move_made = False
                     animate = False
                     game_over = False
 
-        # AI move finder
-        if not game_over and not human_turn:
-            ai_move = SmartMoveFinder.find_best_move_min_max(gs, valid_moves)
-            if ai_move is None:
-                ai_move = SmartMoveFinder.find_random_moves(valid_moves)
-            gs.make_move(ai_move)
-            move_made = True
-            animate = True
+        # AI move finder, runs in the background while the window keeps drawing
+        if not game_over and not human_turn and running:
+            if ai_search is None:
+                ai_search = start_ai_search(
+                    gs, tt, executor, book, bitbases, ai_results
+                )
+            if ai_deadline is not None and time.perf_counter() >= ai_deadline:
+                ai_search[1].set()  # Stops the search, it still reports its move
+                ai_deadline = None
+            try:
+                cancel, move_id, reply_id = ai_results.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                if cancel is ai_search[1]:  # Not a result of a cancelled search
+                    ai_search[0].join()
+                    ai_search = None
+                    ai_deadline = None
+                    for ai_move in valid_moves:
+                        if ai_move.move_id == move_id:
+                            break
+                    else:
+                        ai_move = SmartMoveFinder.find_random_moves(valid_moves)
+                    gs.make_move(ai_move)
+                    move_made = True
+                    animate = True
+                    human_next = (gs.white_to_move and player_one) or (
+                        not gs.white_to_move and player_two
+                    )
+                    if ai_ponder and reply_id and human_next:
+                        # Think about the position after the expected reply meanwhile
+                        ai_search = start_ai_search(
+                            gs, tt, executor, book, bitbases, ai_results, reply_id
+                        )
+                        if ai_search is not None:
+                            ponder_move_id = reply_id
+                            ponder_start = time.perf_counter()
 
         if move_made:
             if animate:
@@ -115,6 +207,144 @@ def main():
         clock.tick(max_fps)
         p.display.flip()
 
+    if executor is not None:
+        executor.shutdown()
+    if book is not None:
+        book.close()
+    if bitbases is not None:
+        bitbases.close()
+
+
+"""
+Start searching the AI move in a background thread. The search gets its own copy of the
+game, the game can change while it runs. The copy replays the moves from the start so
+that the search sees repetitions of earlier positions. With a ponder_move_id the
+expected reply is played on the copy first and the search has no time limit, it runs
+until it is stopped. Returns (thread, cancel event), or None when the reply isn't legal
+"""
+
+
+def start_ai_search(gs, tt, executor, book, bitbases, ai_results, ponder_move_id=0):
+    position = ChessEngine.GameState()
+    for move in gs.move_log:
+        position.make_move(position.get_legal_move(move.move_id))
+    time_limit_ms = ai_time_limit_ms
+    if ponder_move_id:
+        reply = position.get_legal_move(ponder_move_id)
+        if reply is None:
+            return None
+        position.make_move(reply)
+        time_limit_ms = None
+    cancel = threading.Event()
+    thread = threading.Thread(
+        target=run_ai_search,
+        args=(
+            position,
+            tt,
+            executor,
+            book,
+            bitbases,
+            cancel,
+            ai_results,
+            time_limit_ms,
+        ),
+        daemon=True,
+    )
+    thread.start()
+    return thread, cancel
+
+
+"""
+Puts (cancel event, best move_id, move_id of the expected reply) on the queue, the reply
+comes from the principal variation and is 0 when there is none. Positions in the opening
+book are answered from the book without searching
+"""
+
+
+def run_ai_search(gs, tt, executor, book, bitbases, cancel, ai_results, time_limit_ms):
+    valid_moves = gs.get_valid_moves()
+    book_move = book.choose_move(gs, valid_moves) if book is not None else None
+    if book_move is not None:
+        ai_results.put((cancel, book_move.move_id, 0))
+        return
+    if executor is not None:
+        result = ParallelSearch.find_best_move_parallel(
+            gs,
+            valid_moves,
+            SmartMoveFinder.max_search_depth,
+            executor,
+            cancel=cancel,
+            time_limit_ms=time_limit_ms,
+        )
+    else:
+        result = SmartMoveFinder.find_best_move_iterative(
+            gs,
+            valid_moves,
+            time_limit_ms=time_limit_ms,
+            tt=tt,
+            cancel=cancel,
+            bitbases=bitbases,
+        )
+    ai_results.put(
+        (
+            cancel,
+            result.best_move.move_id if result.best_move is not None else 0,
+            result.pv[1].move_id if len(result.pv) > 1 else 0,
+        )
+    )
+
+
+"""
+Cancel a running AI search and wait for it, so two searches never share the
+transposition table. Whatever it still reports is dropped by the main loop. Returns None
+to clear the caller's reference
+"""
+
+
+def stop_ai_search(ai_search):
+    if ai_search is not None:
+        thread, cancel = ai_search
+        cancel.set()
+        thread.join()
+    return None
+
+
+"""
+Let the player pick the piece for a promotion: the four pieces are shown on the
+promotion square's file, towards the middle of the board. Returns the move of
+valid_moves promoting to the clicked piece, or None when the click is anywhere else
+"""
+
+
+def choose_promotion(screen, clock, valid_moves, move):
+    color = move.piece_moved[0]
+    step = 1 if move.end_row == 0 else -1
+    choices = {}
+    for i, piece in enumerate(ChessEngine.promotion_pieces):
+        row = move.end_row + i * step
+        square = p.Rect(move.end_col * sq_size, row * sq_size, sq_size, sq_size)
+        p.draw.rect(screen, p.Color("white"), square)
+        p.draw.rect(screen, p.Color("black"), square, 1)
+        screen.blit(Images[color + piece], square)
+        choices[row] = piece
+    p.display.flip()
+    while True:
+        for e in p.event.get():
+            if e.type == p.QUIT:
+                p.event.post(e)  # Left for the main loop
+                return None
+            if e.type == p.MOUSEBUTTONDOWN:
+                col, row = e.pos[0] // sq_size, e.pos[1] // sq_size
+                if col != move.end_col or row not in choices:
+                    return None
+                for valid_move in valid_moves:
+                    if (
+                        valid_move.move_id & 0xFFF == move.move_id & 0xFFF
+                        and valid_move.promotion_piece == choices[row]
+                    ):
+                        return valid_move
+        clock.tick(max_fps)
+
 
 """
 Highlight square selected and the possible moves of the piece on the selected square
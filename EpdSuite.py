@@ -0,0 +1,159 @@
+import argparse
+import collections
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import SmartMoveFinder
+from BitboardEngine import BitboardGameState
+from Pgn import parse_san
+from TranspositionTable import TranspositionTable
+
+suite_tt_size_mb = 16  # Transposition table for each position
+
+"""
+Test suite runner for EPD files
+(https://www.chessprogramming.org/Extended_Position_Description). Each line is the first
+four FEN fields followed by operations such as bm (best moves), am (moves to avoid) and
+id. The file is read one line at a time, so suites of any size run in constant memory. A
+position is solved when the search picks one of its bm moves and none of its am moves
+"""
+
+
+def read_epd(path):
+    with open(path, encoding="utf-8", errors="replace") as epd:
+        for line in epd:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+"""
+Split an EPD line into the FEN of the position and a dict of its operations. The
+operands of each operation are kept as a list of strings
+"""
+
+
+def parse_epd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD line needs the four position fields: " + line)
+    fen = " ".join(fields[:4])
+    operations = {}
+    rest = fields[4] if len(fields) > 4 else ""
+    for operation in rest.split(";"):
+        tokens = operation.split()
+        if tokens:
+            operations[tokens[0]] = [token.strip('"') for token in tokens[1:]]
+    if "hmvc" in operations:
+        fen += " " + operations["hmvc"][0] + " " + operations.get("fmvn", ["1"])[0]
+    return fen, operations
+
+
+def san_move_ids(sans, valid_moves):
+    move_ids = set()
+    for san in sans:
+        move = parse_san(san.rstrip("+#!?"), valid_moves)
+        if move is not None:
+            move_ids.add(move.move_id)
+    return move_ids
+
+
+"""
+Search one EPD position. Runs in a worker process when the suite is spread over a pool,
+so it takes and returns only plain values: (id, solved, move played, nodes, seconds).
+solved is None when the position has neither bm nor am
+"""
+
+
+def solve_position(line, time_limit_ms=None, max_depth=None):
+    fen, operations = parse_epd(line)
+    gs = BitboardGameState()
+    gs.load_fen(fen)
+    valid_moves = gs.get_valid_moves()
+    options = {
+        "time_limit_ms": time_limit_ms,
+        "tt": TranspositionTable(suite_tt_size_mb),
+    }
+    if max_depth is not None:
+        options["max_depth"] = max_depth
+    start = time.perf_counter()
+    result = SmartMoveFinder.find_best_move_iterative(gs, valid_moves, **options)
+    elapsed = time.perf_counter() - start
+    best_moves = san_move_ids(operations.get("bm", []), valid_moves)
+    avoid_moves = san_move_ids(operations.get("am", []), valid_moves)
+    move_id = result.best_move.move_id if result.best_move is not None else 0
+    solved = None
+    if best_moves or avoid_moves:
+        solved = move_id not in avoid_moves and (
+            not best_moves or move_id in best_moves
+        )
+    played = result.best_move.get_chess_notation() if result.best_move else "-"
+    position_id = operations.get("id", [fen])[0]
+    return position_id, solved, played, result.nodes + result.qnodes, elapsed
+
+
+"""
+Results of every position of the suite in file order. With workers the positions run on
+a process pool, only a few of them are read ahead of the results being collected
+"""
+
+
+def run_suite(path, time_limit_ms=None, max_depth=None, workers=0):
+    lines = read_epd(path)
+    if not workers:
+        for line in lines:
+            yield solve_position(line, time_limit_ms, max_depth)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for line in lines:
+            pending.append(
+                executor.submit(solve_position, line, time_limit_ms, max_depth)
+            )
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an EPD test suite")
+    parser.add_argument("epd", help="EPD file with the positions")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--time", type=int, help="milliseconds for each position")
+    limit.add_argument("--depth", type=int, help="search depth for each position")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="processes to spread the positions over, 0 runs them in this process",
+    )
+    args = parser.parse_args()
+    time_limit_ms = args.time
+    if args.time is None and args.depth is None:
+        time_limit_ms = 1000
+
+    positions = solved = scored = nodes = 0
+    start = time.perf_counter()
+    for position_id, position_solved, played, position_nodes, elapsed in run_suite(
+        args.epd, time_limit_ms, args.depth, args.workers
+    ):
+        positions += 1
+        nodes += position_nodes
+        if position_solved is not None:
+            scored += 1
+            solved += position_solved
+        status = {True: "ok", False: "FAIL", None: "-"}[position_solved]
+        print(
+            "%-20s %-6s %9d nodes %7.2f s  %s"
+            % (position_id, played, position_nodes, elapsed, status)
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        "Solved %d of %d (%d positions), %d nodes in %.2f s, %.0f nodes/s"
+        % (solved, scored, positions, nodes, elapsed, nodes / elapsed if elapsed else 0)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+"""
+Bounded cache of legal move lists keyed by GameState.zobrist_key, for positions that get
+their moves generated again (the game loop after every move and undo, transpositions in
+the search). Each entry is the move list as a tuple and whether the side to move was in
+check, which is all get_valid_moves needs to set in_check, checkmate and stalemate
+again. When it holds max_entries positions the least recently used one is evicted.
+The key covers the pieces, side to move, castling rights and en passant file, so a
+position reached again by undo_move finds its own moves. Changing gs.board directly
+(anything but make_move, undo_move and load_fen) leaves the key behind, the cache has to
+be cleared then
+"""
+
+
+class MoveCache:
+
+    def __init__(self, max_entries=4096):
+        if max_entries < 1:
+            raise ValueError("A move cache needs room for at least one position")
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    """
+    Returns (moves, in_check) for a position or None, and marks it as recently used
+    """
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, moves, in_check):
+        entries = self.entries
+        entries[key] = (tuple(moves), in_check)
+        entries.move_to_end(key)
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "max_entries": self.max_entries,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate(),
+        }
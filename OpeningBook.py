@@ -0,0 +1,148 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+
+from ChessEngine import GameState
+from Pgn import parse_san, read_games
+
+"""
+Opening book in the Polyglot layout: 16 byte big-endian entries of key (8 bytes), move
+(2), weight (2) and learn (4), sorted by key. The key is GameState.zobrist_key and the
+move a move_id, so books are made for this engine by build_book and can't be swapped
+with Polyglot books made for other engines
+"""
+
+entry_format = ">QHHI"
+entry_size = struct.calcsize(entry_format)
+max_weight = 0xFFFF
+
+
+"""
+A book file mapped into memory. Nothing is read up front, a lookup is a binary search
+over the mapped entries
+"""
+
+
+class OpeningBook:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % entry_size != 0:
+            self.file.close()
+            raise ValueError(
+                "Book size is not a multiple of %d bytes: %s" % (entry_size, path)
+            )
+        self.entry_count = size // entry_size
+        self.data = b""  # An empty file can't be mapped, it is a book without entries
+        if size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def entry(self, index):
+        return struct.unpack_from(entry_format, self.data, index * entry_size)
+
+    """
+    (move_id, weight) of every book move of the position with this key
+    """
+
+    def get_moves(self, key):
+        low = 0
+        high = self.entry_count
+        while low < high:  # First entry with a key >= key
+            middle = (low + high) // 2
+            if struct.unpack_from(">Q", self.data, middle * entry_size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        while low < self.entry_count:
+            entry_key, move_id, weight, _ = self.entry(low)
+            if entry_key != key:
+                break
+            moves.append((move_id, weight))
+            low += 1
+        return moves
+
+    """
+    A book move for the position picked at random by weight, or None when the position
+    isn't in the book. Only moves found in valid_moves are returned
+    """
+
+    def choose_move(self, gs, valid_moves, rng=random):
+        moves_by_id = {move.move_id: move for move in valid_moves}
+        book_moves = [
+            (moves_by_id[move_id], weight)
+            for move_id, weight in self.get_moves(gs.zobrist_key)
+            if move_id in moves_by_id and weight > 0
+        ]
+        if not book_moves:
+            return None
+        pick = rng.randrange(sum(weight for _, weight in book_moves))
+        for move, weight in book_moves:
+            if pick < weight:
+                return move
+            pick -= weight
+
+
+"""
+Count how often each move was played from each position in the first max_plies plies
+of the games, and write the counts as weights. Games stop at the first move that can't
+be parsed
+"""
+
+
+def build_book(pgn_path, book_path, max_plies=20):
+    counts = {}
+    games = 0
+    for _, moves in read_games(pgn_path):
+        gs = GameState()
+        for san in moves[:max_plies]:
+            move = parse_san(san, gs.get_valid_moves())
+            if move is None:
+                break
+            entry = (gs.zobrist_key, move.move_id)
+            counts[entry] = counts.get(entry, 0) + 1
+            gs.make_move(move)
+        games += 1
+    largest = max(counts.values()) if counts else 1
+    with open(book_path, "wb") as book:
+        for (key, move_id), count in sorted(
+            counts.items(), key=lambda item: (item[0][0], -item[1])
+        ):
+            # Scaled down only when the counts don't fit in the weight field
+            if largest > max_weight:
+                count = max(1, count * max_weight // largest)
+            book.write(struct.pack(entry_format, key, move_id, count, 0))
+    return games, len(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build an opening book from a PGN file"
+    )
+    parser.add_argument("pgn", help="PGN file with the games")
+    parser.add_argument("book", help="book file to write")
+    parser.add_argument(
+        "--plies", type=int, default=20, help="plies of each game that go in the book"
+    )
+    args = parser.parse_args()
+    games, entries = build_book(args.pgn, args.book, args.plies)
+    print("%d games, %d book entries written to %s" % (games, entries, args.book))
+
+
+if __name__ == "__main__":
+    main()
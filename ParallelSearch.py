@@ -0,0 +1,309 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import SmartMoveFinder
+from BitboardEngine import BitboardGameState
+from TranspositionTable import TranspositionTable
+
+worker_tt_size_mb = 16  # Transposition table of each worker process
+
+"""
+Root-parallel search on a ProcessPoolExecutor: the root moves are split over the worker
+processes, one task per move. A position goes to a worker as its FEN and the move as its
+move_id, so only a short string and a few numbers cross the process boundary. The first
+root move is searched on its own so that the others only have to prove they are no
+better than it (a narrower window), then the rest run in parallel. Worker processes
+don't share their transposition tables. The pool shares one number with its workers, the
+id of the search the parent process is running, a task of any other search stops
+"""
+
+worker_tt = None  # Set in each worker process by init_worker
+worker_search_id = None  # The pool's shared search id, set by init_worker
+last_search_id = 0  # Search the worker's last task belonged to
+
+cancel_poll_interval = 0.05  # Seconds between looks at the cancel event while waiting
+
+
+def init_worker(tt_size_mb, search_id):
+    global worker_tt, worker_search_id
+    worker_tt = TranspositionTable(tt_size_mb)
+    worker_search_id = search_id
+
+
+"""
+Process pool for find_best_move_parallel, workers=None uses every core. Each worker
+keeps its transposition table for as long as the pool lives
+"""
+
+
+class SearchExecutor(ProcessPoolExecutor):
+
+    def __init__(self, workers=None, tt_size_mb=worker_tt_size_mb):
+        self.search_id = multiprocessing.Value("i", 0, lock=False)
+        super().__init__(
+            max_workers=workers or os.cpu_count(),
+            initializer=init_worker,
+            initargs=(tt_size_mb, self.search_id),
+        )
+
+    """
+    Start a new search, tasks of the one before stop at their next limit check
+    """
+
+    def next_search(self):
+        self.search_id.value += 1
+        return self.search_id.value
+
+
+def new_executor(workers=None, tt_size_mb=worker_tt_size_mb):
+    return SearchExecutor(workers, tt_size_mb)
+
+
+"""
+The cancel event of a worker task's SearchContext, it is set once the parent process has
+gone on to another search or given this one up
+"""
+
+
+class SearchOver:
+
+    def __init__(self, search_id):
+        self.search_id = search_id
+
+    def is_set(self):
+        return worker_search_id.value != self.search_id
+
+
+"""
+Runs in a worker: play the root move and search the reply to depth - 1. Returns the
+score of the move for the side that played it, or an upper bound when it is <= alpha,
+whether the search was stopped (by the deadline, a time.time() value, or because the
+search is over) before it was done, the score is no good then, and the move_ids of the
+principal variation below the move
+"""
+
+
+def search_root_move(
+    fen, move_id, depth, alpha, search_id, deadline=None, quiescence=True
+):
+    global last_search_id
+    if search_id != last_search_id:  # First task of a new search on this worker
+        worker_tt.new_search()
+        last_search_id = search_id
+    time_limit_ms = None
+    if deadline is not None:
+        time_limit_ms = max(deadline - time.time(), 0) * 1000
+    gs = BitboardGameState()
+    gs.load_fen(fen)
+    gs.make_move(gs.get_legal_move(move_id))
+    ctx = SmartMoveFinder.SearchContext(
+        worker_tt, time_limit_ms, quiescence=quiescence, cancel=SearchOver(search_id)
+    )
+    turn_multiplier = 1 if gs.white_to_move else -1
+    score = -SmartMoveFinder.find_move_negamax_alphabeta(
+        gs,
+        None,
+        depth - 1,
+        -SmartMoveFinder.checkmate,
+        -alpha,
+        turn_multiplier,
+        ctx,
+        1,
+    )
+    pv_ids = [move.move_id for move in ctx.pv[1]]
+    if not pv_ids:  # Cut off by the table at once, its move is the reply
+        entry = worker_tt.probe(gs.zobrist_key)
+        if entry is not None and entry[3]:
+            pv_ids = [entry[3]]
+    return move_id, score, ctx.nodes, ctx.qnodes, ctx.stopped, pv_ids
+
+
+"""
+Result of a search_root_move task, or None when the cancel event is set first
+"""
+
+
+def wait_for(future, cancel):
+    if cancel is None:
+        return future.result()
+    while not cancel.is_set():
+        try:
+            return future.result(timeout=cancel_poll_interval)
+        except TimeoutError:
+            pass
+    return None
+
+
+"""
+The principal variation as moves of gs: the root move, then the moves a worker found
+below it
+"""
+
+
+def principal_variation(gs, root_move, pv_ids):
+    pv = [root_move]
+    gs.make_move(root_move)
+    for move_id in pv_ids:
+        move = gs.get_legal_move(move_id)
+        if move is None:
+            break
+        pv.append(move)
+        gs.make_move(move)
+    for _ in pv:
+        gs.undo_move()
+    return pv
+
+
+"""
+Search gs with the root moves spread over the executor's processes. It deepens one ply
+at a time like find_best_move_iterative, up to depth or until time_limit_ms is used up,
+every iteration starts with the best move of the last one, which gives the other moves a
+good alpha to fail low against. An iteration that runs out of time or is cancelled is
+dropped, the result is that of the last complete one
+"""
+
+
+def find_best_move_parallel(
+    gs,
+    valid_moves,
+    depth,
+    executor,
+    quiescence=True,
+    cancel=None,
+    time_limit_ms=None,
+):
+    result = SmartMoveFinder.SearchResult()
+    start = time.perf_counter()
+    if len(valid_moves) == 0:
+        return result
+    deadline = None
+    if time_limit_ms is not None:
+        deadline = time.time() + time_limit_ms / 1000
+    search_id = executor.next_search()
+    fen = gs.get_fen()
+    moves = SmartMoveFinder.MoveOrdering().order_moves(valid_moves, 0, 0)
+    for iteration_depth in range(1, depth + 1):
+        first = executor.submit(
+            search_root_move,
+            fen,
+            moves[0].move_id,
+            iteration_depth,
+            -SmartMoveFinder.checkmate,
+            search_id,
+            deadline,
+            quiescence,
+        )
+        done = wait_for(first, cancel)
+        if done is None:  # Cancelled
+            break
+        _, alpha, nodes, qnodes, stopped, best_pv_ids = done
+        result.nodes += nodes
+        result.qnodes += qnodes
+        if stopped:
+            break
+        best_move = moves[0]
+        futures = [
+            executor.submit(
+                search_root_move,
+                fen,
+                move.move_id,
+                iteration_depth,
+                alpha,
+                search_id,
+                deadline,
+                quiescence,
+            )
+            for move in moves[1:]
+        ]
+        scores = {}
+        # Ties keep the better ordered move
+        for move, future in zip(moves[1:], futures):
+            done = wait_for(future, cancel)
+            if done is None:  # Cancelled
+                stopped = True
+                break
+            _, score, nodes, qnodes, stopped, pv_ids = done
+            result.nodes += nodes
+            result.qnodes += qnodes
+            if stopped:
+                break
+            scores[move.move_id] = score
+            if score > alpha:
+                best_move = move
+                alpha = score
+                best_pv_ids = pv_ids
+        if stopped:
+            for future in futures:
+                future.cancel()
+            break
+        # The next iteration starts from the best move, the rest by their (bound) scores
+        moves = [best_move] + sorted(
+            (move for move in moves if move is not best_move),
+            key=lambda move: scores.get(move.move_id, alpha),
+            reverse=True,
+        )
+        result.best_move = best_move
+        result.score = alpha
+        result.depth = iteration_depth
+        result.pv = principal_variation(gs, best_move, best_pv_ids)
+        result.iterations.append({"depth": iteration_depth, "score": alpha})
+        if abs(alpha) >= SmartMoveFinder.checkmate:  # Forced mate found
+            break
+    executor.next_search()  # Tasks still running stop at their next limit check
+
+    if result.best_move is None:
+        # Not even depth 1 finished, fall back to the best ordered move
+        result.best_move = moves[0]
+    result.time_ms = (time.perf_counter() - start) * 1000
+    return result
+
+
+"""
+Time-to-depth of the single process search against the root-parallel search with
+different worker counts, over the benchmark positions
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Root-parallel search benchmark")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    from SearchBenchmark import benchmark_positions  # Only the benchmark needs it
+
+    print("Cores available: %d" % os.cpu_count())
+
+    start = time.perf_counter()
+    nodes = 0
+    for gs in benchmark_positions():
+        result = SmartMoveFinder.find_best_move_iterative(
+            gs,
+            gs.get_valid_moves(),
+            max_depth=args.depth,
+            tt=TranspositionTable(worker_tt_size_mb),
+        )
+        nodes += result.nodes + result.qnodes
+    single = time.perf_counter() - start
+    print("single process  depth %d: %9d nodes %8.2f s" % (args.depth, nodes, single))
+
+    for workers in args.workers:
+        with new_executor(workers) as executor:
+            start = time.perf_counter()
+            nodes = 0
+            for gs in benchmark_positions():
+                result = find_best_move_parallel(
+                    gs, gs.get_valid_moves(), args.depth, executor
+                )
+                nodes += result.nodes + result.qnodes
+            elapsed = time.perf_counter() - start
+        print(
+            "%d workers       depth %d: %9d nodes %8.2f s  speedup %.2fx"
+            % (workers, args.depth, nodes, elapsed, single / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import time
+
+from BitboardEngine import BitboardGameState
+from ChessEngine import GameState
+
+start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+"""
+Reference positions with their known leaf counts for depth 1, 2, 3...
+(https://www.chessprogramming.org/Perft_Results)
+"""
+
+reference_positions = [
+    ("start", start_fen, [20, 400, 8902, 197281]),
+    (
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603],
+    ),
+    (
+        "position 3",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    (
+        "position 4",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    (
+        "position 5",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487],
+    ),
+    (
+        "position 6",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594],
+    ),
+]
+
+
+def new_game_state(fen=start_fen, bitboards=False):
+    gs = BitboardGameState() if bitboards else GameState()
+    gs.load_fen(fen)
+    return gs
+
+
+"""
+Count the leaf nodes of the legal move tree to the given depth. The last ply is counted
+from the length of the move list instead of making every move (bulk counting), that
+leaves most of the make_move / undo_move work out of the timing. bulk=False makes and
+takes back every leaf move as well
+"""
+
+
+def perft(gs, depth, bulk=True):
+    if depth == 0:
+        return 1
+    moves = gs.get_valid_moves()
+    if depth == 1 and bulk:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1, bulk)
+        gs.undo_move()
+    return nodes
+
+
+"""
+Leaf count below every root move, the usual way to find where two move generators differ
+"""
+
+
+def divide(gs, depth, bulk=True):
+    counts = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        counts[move.get_chess_notation()] = perft(gs, depth - 1, bulk)
+        gs.undo_move()
+    return counts
+
+
+def timed_perft(gs, depth, bulk=True):
+    start = time.perf_counter()
+    nodes = perft(gs, depth, bulk)
+    return nodes, time.perf_counter() - start
+
+
+def run_suite(max_depth=None, bitboards=False, bulk=True):
+    passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected_counts in reference_positions:
+        for depth, expected in enumerate(expected_counts, 1):
+            if max_depth is not None and depth > max_depth:
+                break
+            nodes, elapsed = timed_perft(new_game_state(fen, bitboards), depth, bulk)
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok" if nodes == expected else "FAIL (expected %d)" % expected
+            passed = passed and nodes == expected
+            print(
+                "%-11s depth %d: %9d nodes %8.2f s %9.0f nodes/s  %s"
+                % (name, depth, nodes, elapsed, nodes / max(elapsed, 1e-9), status)
+            )
+    print(
+        "Total: %d nodes in %.2f s, %.0f nodes/s"
+        % (total_nodes, total_time, total_nodes / max(total_time, 1e-9))
+    )
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft move generation benchmark")
+    parser.add_argument("--fen", default=start_fen, help="position to count from")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument(
+        "--divide",
+        action="store_true",
+        help="print the leaf count below every root move",
+    )
+    parser.add_argument(
+        "--suite", action="store_true", help="run the reference positions up to --depth"
+    )
+    parser.add_argument(
+        "--bitboards", action="store_true", help="use the bitboard backend"
+    )
+    parser.add_argument(
+        "--no-bulk",
+        dest="bulk",
+        action="store_false",
+        help="make and undo the moves of the last ply instead of counting them",
+    )
+    args = parser.parse_args()
+
+    if args.suite:
+        if not run_suite(args.depth, args.bitboards, args.bulk):
+            raise SystemExit(1)
+        return
+
+    gs = new_game_state(args.fen, args.bitboards)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(gs, args.depth, args.bulk)
+        for notation in sorted(counts):
+            print("%s: %d" % (notation, counts[notation]))
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gs, args.depth, args.bulk)
+    elapsed = time.perf_counter() - start
+    print(
+        "Nodes: %d  Time: %.2f s  Nodes/s: %.0f"
+        % (nodes, elapsed, nodes / max(elapsed, 1e-9))
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import re
+import time
+
+from ChessEngine import GameState, Move
+
+"""
+Reading and writing PGN game files. Games are read one at a time as (headers, SAN moves)
+by a generator and written one at a time, so a collection of any size goes through in
+the memory of a single game
+"""
+
+tag_pattern = re.compile(r'^\[(\w+)\s+"(.*)"\]$')
+san_pattern = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(=?[NBRQ])?$")
+result_tokens = ("1-0", "0-1", "1/2-1/2", "*")
+# The tags every PGN game starts with, in their required order
+seven_tag_roster = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+line_width = 79
+
+"""
+(headers, SAN moves) of each game of a PGN file, read one game at a time
+"""
+
+
+def read_games(path):
+    headers = {}
+    movetext = []
+    with open(path, encoding="utf-8", errors="replace") as pgn:
+        for line in pgn:
+            line = line.strip()
+            if line.startswith("["):  # Tag pair, a new game's headers
+                if movetext:
+                    yield headers, san_moves(" ".join(movetext))
+                    headers = {}
+                    movetext = []
+                match = tag_pattern.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"')
+            elif line and not line.startswith("%"):
+                movetext.append(line)
+    if movetext or headers:
+        yield headers, san_moves(" ".join(movetext))
+
+
+"""
+The SAN moves of a game's movetext, with comments, variations, move numbers, annotations
+and the result left out
+"""
+
+
+def san_moves(movetext):
+    movetext = re.sub(r"\{[^}]*\}|;[^\n]*", " ", movetext)
+    while "(" in movetext:  # Variations can be nested, strip the innermost first
+        stripped = re.sub(r"\([^()]*\)", " ", movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    moves = []
+    for token in movetext.split():
+        token = re.sub(r"^\d+\.+", "", token)  # Move numbers, also glued to a move
+        if not token or token.startswith("$") or token in result_tokens:
+            continue
+        moves.append(token.rstrip("+#!?"))
+    return moves
+
+
+"""
+The move of valid_moves a SAN string stands for, or None when it doesn't fit any
+"""
+
+
+def parse_san(san, valid_moves):
+    castle_col = {"O-O": 6, "0-0": 6, "O-O-O": 2, "0-0-0": 2}.get(san)
+    if castle_col is not None:
+        for move in valid_moves:
+            if move.castle and move.end_col == castle_col:
+                return move
+        return None
+    match = san_pattern.match(san)
+    if match is None:
+        return None
+    piece, from_file, from_rank, target, promotion = match.groups()
+    piece = piece or "p"
+    promotion_piece = promotion[-1] if promotion else ""
+    end_row = Move.ranks_to_rows[target[1]]
+    end_col = Move.files_to_cols[target[0]]
+    found = None
+    for move in valid_moves:
+        if (
+            move.end_row == end_row
+            and move.end_col == end_col
+            and move.piece_moved[1] == piece
+            and (from_file is None or move.start_col == Move.files_to_cols[from_file])
+            and (from_rank is None or move.start_row == Move.ranks_to_rows[from_rank])
+            and move.promotion_piece == promotion_piece
+        ):
+            if found is not None:  # Ambiguous
+                return None
+            found = move
+    return found
+
+
+"""
+SAN of a move of valid_moves, the legal moves of gs. The move is made and taken back to
+add the check or mate sign
+"""
+
+
+def get_san(gs, move, valid_moves):
+    if move.castle:
+        san = "O-O" if move.end_col == 6 else "O-O-O"
+    else:
+        piece = move.piece_moved[1]
+        target = move.get_rank_file(move.end_row, move.end_col)
+        capture = move.piece_captured != "  "
+        if piece == "p":
+            san = (Move.cols_to_files[move.start_col] + "x" if capture else "") + target
+            if move.pawn_promotion:
+                san += "=" + move.promotion_piece
+        else:
+            # Tell apart pieces of the same kind that can go to the same square
+            others = [
+                other
+                for other in valid_moves
+                if other.end_row == move.end_row
+                and other.end_col == move.end_col
+                and other.piece_moved == move.piece_moved
+                and (other.start_row, other.start_col)
+                != (move.start_row, move.start_col)
+            ]
+            origin = ""
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    origin = Move.cols_to_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in others):
+                    origin = Move.rows_to_ranks[move.start_row]
+                else:
+                    origin = move.get_rank_file(move.start_row, move.start_col)
+            san = piece + origin + ("x" if capture else "") + target
+    gs.make_move(move)
+    replies = gs.get_valid_moves()
+    if gs.in_check:
+        san += "+" if replies else "#"
+    gs.undo_move()
+    return san
+
+
+"""
+Play the SAN moves of a game on gs through make_move, yielding each move once it is
+made. Raises ValueError at the first move that isn't legal in the position
+"""
+
+
+def replay_game(gs, sans):
+    for san in sans:
+        move = parse_san(san, gs.get_valid_moves())
+        if move is None:
+            raise ValueError("Illegal or ambiguous move %s in %s" % (san, gs.get_fen()))
+        gs.make_move(move)
+        yield move
+
+
+"""
+GameState at the start of a game, from its FEN tag when it has one
+"""
+
+
+def start_position(headers):
+    gs = GameState()
+    if "FEN" in headers:
+        gs.load_fen(headers["FEN"])
+    return gs
+
+
+"""
+Write one game: the seven tag roster first, then the other tags, then the movetext
+wrapped to line_width columns and the result
+"""
+
+
+def write_game(out, headers, sans, first_move_number=1, white_first=True):
+    result = headers.get("Result", "*")
+    tags = [(tag, headers.get(tag, "?")) for tag in seven_tag_roster[:-1]]
+    tags.append(("Result", result))
+    tags.extend(item for item in headers.items() if item[0] not in seven_tag_roster)
+    for tag, value in tags:
+        out.write('[%s "%s"]\n' % (tag, value.replace('"', '\\"')))
+    out.write("\n")
+    tokens = []
+    move_number = first_move_number
+    white_to_move = white_first
+    for i, san in enumerate(sans):
+        if white_to_move:
+            tokens.append("%d." % move_number)
+        elif i == 0:
+            tokens.append("%d..." % move_number)
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > line_width:
+            out.write(line + "\n")
+            line = token
+        else:
+            line = line + " " + token if line else token
+    out.write(line + "\n\n")
+
+
+"""
+Replay every game of a PGN file through the engine. With an output file the games are
+written back out with the engine's own SAN
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the games of a PGN file")
+    parser.add_argument("pgn", help="PGN file with the games")
+    parser.add_argument("--output", help="write the replayed games to this PGN file")
+    args = parser.parse_args()
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+    games = plies = errors = 0
+    start = time.perf_counter()
+    for headers, sans in read_games(args.pgn):
+        games += 1
+        gs = start_position(headers)
+        first_move_number = gs.fullmove_number
+        white_first = gs.white_to_move
+        written = []
+        try:
+            for move in replay_game(gs, sans):
+                plies += 1
+                if out is not None:
+                    gs.undo_move()
+                    written.append(get_san(gs, move, gs.get_valid_moves()))
+                    gs.make_move(move)
+        except ValueError as error:
+            errors += 1
+            print("Game %d: %s" % (games, error))
+        if out is not None:
+            write_game(out, headers, written, first_move_number, white_first)
+    elapsed = time.perf_counter() - start
+    if out is not None:
+        out.close()
+    print(
+        "%d games, %d plies, %d errors in %.2f s, %.0f plies/s"
+        % (games, plies, errors, elapsed, plies / elapsed if elapsed else 0)
+    )
+
+
+if __name__ == "__main__":
+    main()
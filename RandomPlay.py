@@ -0,0 +1,151 @@
+import argparse
+import random
+import time
+
+from BitboardEngine import BitboardGameState
+from ChessEngine import GameState
+
+"""
+Consistency check of make_move / undo_move by random play. The same random games are
+played on both backends at once. After every move the incrementally kept state (Zobrist
+key, evaluation, piece squares, king locations, bitboards) is compared with a
+recomputation from the board, both backends have to generate the same legal moves, and
+taking a move back, a null move included, has to give the position back exactly
+"""
+
+
+def snapshot(gs):
+    state = (
+        gs.get_fen(),
+        gs.zobrist_key,
+        [row[:] for row in gs.board],
+        (gs.mg_score, gs.eg_score, gs.phase),
+        {color: set(squares) for color, squares in gs.piece_squares.items()},
+        gs.white_king_location,
+        gs.black_king_location,
+    )
+    if isinstance(gs, BitboardGameState):
+        state += (dict(gs.bitboards), dict(gs.occupancy))
+    return state
+
+
+"""
+What is wrong with the incremental state of gs, an empty list when nothing is
+"""
+
+
+def check_state(gs):
+    errors = []
+    if gs.zobrist_key != gs.compute_zobrist_key():
+        errors.append("Zobrist key")
+    if (gs.mg_score, gs.eg_score, gs.phase) != gs.compute_evaluation():
+        errors.append("evaluation")
+    if gs.piece_squares != gs.compute_piece_squares():
+        errors.append("piece squares")
+    for king, location in (
+        ("wK", gs.white_king_location),
+        ("bK", gs.black_king_location),
+    ):
+        if gs.board[location[0]][location[1]] != king:
+            errors.append(king + " location")
+    if isinstance(gs, BitboardGameState):
+        bitboards = dict(gs.bitboards)
+        occupancy = dict(gs.occupancy)
+        gs.sync_bitboards()
+        if bitboards != gs.bitboards or occupancy != gs.occupancy:
+            errors.append("bitboards")
+    return errors
+
+
+"""
+Make and take back every legal move of the position, and a null move when the side to
+move isn't in check
+"""
+
+
+def check_moves(gs, moves):
+    errors = []
+    before = snapshot(gs)
+    in_check = gs.in_check
+    for move in moves:
+        gs.make_move(move)
+        errors += [
+            "%s after %s" % (error, move.get_chess_notation())
+            for error in check_state(gs)
+        ]
+        gs.undo_move()
+        if snapshot(gs) != before:
+            errors.append(
+                "position not restored by undoing %s" % move.get_chess_notation()
+            )
+    if not in_check:
+        gs.make_null_move()
+        errors += ["%s after a null move" % error for error in check_state(gs)]
+        gs.undo_null_move()
+        if snapshot(gs) != before:
+            errors.append("position not restored by undoing a null move")
+    return errors
+
+
+def play_games(games, max_plies, seed):
+    rng = random.Random(seed)
+    errors = []
+    plies = 0
+    for game in range(games):
+        states = (GameState(), BitboardGameState())
+        history = []
+        for ply in range(max_plies):
+            move_lists = [gs.get_valid_moves() for gs in states]
+            move_ids = [sorted(move.move_id for move in moves) for moves in move_lists]
+            if move_ids[0] != move_ids[1]:
+                errors.append(
+                    "Game %d: legal moves differ in %s" % (game, states[0].get_fen())
+                )
+                break
+            for gs, moves in zip(states, move_lists):
+                errors += [
+                    "Game %d ply %d %s: %s" % (game, ply, type(gs).__name__, error)
+                    for error in check_moves(gs, moves)
+                ]
+            if not move_ids[0] or states[0].is_draw():
+                break
+            move_id = rng.choice(move_ids[0])
+            history.append([snapshot(gs) for gs in states])
+            for gs, moves in zip(states, move_lists):
+                gs.make_move(next(move for move in moves if move.move_id == move_id))
+            plies += 1
+        # Take the whole game back, every earlier position has to come back on the way
+        while history:
+            expected = history.pop()
+            for gs, before in zip(states, expected):
+                gs.undo_move()
+                if snapshot(gs) != before:
+                    errors.append(
+                        "Game %d: %s not restored at ply %d"
+                        % (game, type(gs).__name__, len(history))
+                    )
+    return plies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Random play make/undo consistency check"
+    )
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--plies", type=int, default=200, help="longest game in plies")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    plies, errors = play_games(args.games, args.plies, args.seed)
+    for error in errors[:20]:
+        print(error)
+    print(
+        "%d games, %d plies, %d errors in %.2f s"
+        % (args.games, plies, len(errors), time.perf_counter() - start)
+    )
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
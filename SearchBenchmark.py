@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import SmartMoveFinder
+from BitboardEngine import BitboardGameState, benchmark_lines, play_line
+
+"""
+Nodes-to-depth and time-to-depth of the search over a fixed set of positions, used to
+compare search features against each other
+"""
+
+
+def benchmark_positions():
+    positions = []
+    for line in benchmark_lines:
+        gs = BitboardGameState()
+        play_line(gs, line)
+        positions.append(gs)
+    return positions
+
+
+def nodes_to_depth(depth, **search_options):
+    nodes = 0
+    qnodes = 0
+    start = time.perf_counter()
+    for gs in benchmark_positions():
+        result = SmartMoveFinder.find_best_move_iterative(
+            gs, gs.get_valid_moves(), max_depth=depth, **search_options
+        )
+        nodes += result.nodes
+        qnodes += result.qnodes
+    return nodes, qnodes, time.perf_counter() - start
+
+
+no_reductions = {"null_move": 0, "late_moves": 0}
+configurations = {
+    "no ordering": dict(no_reductions, move_ordering=False, quiescence=False),
+    "ordering": dict(no_reductions, quiescence=False),
+    "quiescence": no_reductions,
+    "null move": {"late_moves": 0},
+    "late moves": {"null_move": 0},
+    "selective": {},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search nodes-to-depth benchmark")
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+    for name, options in configurations.items():
+        nodes, qnodes, elapsed = nodes_to_depth(args.depth, **options)
+        print(
+            "%-12s depth %d: %9d nodes %9d qnodes %8.2f s %8.0f nodes/s"
+            % (name, args.depth, nodes, qnodes, elapsed, (nodes + qnodes) / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import random
-import ChessEngine
-
-piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-checkmate = 1000
-stalemate = 0
-depth_total = 2
+import time
 
+from Bitbases import draw, loss
+from ChessEngine import capture_moves, quiet_moves
+from TranspositionTable import exact, lower_bound, upper_bound
 
-gs = ChessEngine.GameState()
+piece_score = {"K": 0, "Q": 900, "R": 500, "B": 330, "N": 320, "p": 100}  # Centipawns
+checkmate = 100000
+stalemate = 0
+depth_total = 2  # Depth of the fixed depth search
+max_search_depth = 64  # Iterative deepening never goes past this
+nodes_between_limit_checks = 256
+delta_margin = 200  # Quiescence skips captures that can't lift the score near alpha
+bitbase_win = 50000  # A won bitbase position, below any mate the search finds itself
+null_move_reduction = 2  # A null move is searched this much shallower than a real move
+late_move_reduction = 1  # Plies taken off quiet moves ordered late
+full_depth_moves = 3  # Moves of a node searched at full depth before any is reduced
+reduction_min_depth = 3  # No null move or reductions closer to the horizon than this
 
 """
 Picks and returns a random move
@@ -56,39 +65,266 @@ def find_best_moves(gs, valid_moves):
     return best_player_move
 
 
+"""
+State of one search: limits, counters and the best root move found so far. Passed down
+the recursion instead of keeping it in module globals
+"""
+
+
+class SearchContext:
+
+    def __init__(
+        self,
+        tt=None,
+        time_limit_ms=None,
+        node_limit=None,
+        move_ordering=True,
+        quiescence=True,
+        cancel=None,
+        bitbases=None,
+        null_move=null_move_reduction,
+        late_moves=late_move_reduction,
+        full_depth=full_depth_moves,
+    ):
+        self.tt = tt
+        self.bitbases = bitbases  # Bitbases.Bitbases probed below the root
+        self.cancel = cancel  # threading.Event another thread sets to stop the search
+        self.nodes = 0
+        self.qnodes = 0  # Quiescence search nodes, counted apart from the main search
+        self.quiescence = quiescence
+        self.node_limit = node_limit
+        self.deadline = None
+        if time_limit_ms is not None:
+            self.deadline = time.perf_counter() + time_limit_ms / 1000
+        self.stopped = False
+        self.best_move = None  # Best root move of the iteration in progress
+        self.root_move_id = 0  # Best root move of the last completed iteration
+        self.ordering = MoveOrdering() if move_ordering else None
+        # Principal variation per ply
+        self.pv = [[] for _ in range(max_search_depth + 1)]
+        # Selective search, a reduction of 0 turns null moves or late moves off
+        if null_move < 0 or late_moves < 0 or full_depth < 0:
+            raise ValueError("Reductions and full depth moves can't be negative")
+        self.null_move_reduction = null_move
+        self.late_move_reduction = late_moves
+        self.full_depth_moves = full_depth
+        self.null_move_cutoffs = 0
+        self.re_searches = 0  # Reduced moves that beat alpha and went to full depth
+
+    """
+    Counts a node and flags the search as stopped once the time or node budget is used
+    up or the search was cancelled
+    """
+
+    def count_node(self, quiescence=False):
+        if quiescence:
+            self.qnodes += 1
+        else:
+            self.nodes += 1
+        nodes = self.nodes + self.qnodes
+        if nodes % nodes_between_limit_checks == 0:
+            if self.node_limit is not None and nodes >= self.node_limit:
+                self.stopped = True
+            elif self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.stopped = True
+            elif self.cancel is not None and self.cancel.is_set():
+                self.stopped = True
+        return self.stopped
+
+
+"""
+Decides in which order the search tries moves: the hash move, then captures by MVV-LVA
+(most valuable victim, least valuable attacker), then the two killer moves of the ply
+and then quiet moves by their history score. Killers and history live as long as the
+object, so they carry over from one iteration of the iterative deepening to the next
+"""
+
+
+class MoveOrdering:
+
+    hash_move_score = 1 << 30
+    capture_score = 1 << 24
+    killer_scores = (1 << 23, (1 << 23) - 1)
+
+    def __init__(self):
+        self.killers = [[0, 0] for _ in range(max_search_depth + 1)]
+        self.history = [0] * (64 * 64)  # Indexed by from square * 64 + to square
+
+    def order_moves(self, moves, hash_move_id, ply):
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            if move.move_id == hash_move_id:
+                score = self.hash_move_score
+            elif move.piece_captured != "  ":
+                score = (
+                    self.capture_score
+                    + 10 * piece_score[move.piece_captured[1]]
+                    - piece_score[move.piece_moved[1]]
+                )
+                if move.pawn_promotion:
+                    score += piece_score[move.promotion_piece]
+            elif move.pawn_promotion:  # Queen promotions first, under promotions after
+                score = self.capture_score + piece_score[move.promotion_piece]
+            elif move.move_id == killers[0]:
+                score = self.killer_scores[0]
+            elif move.move_id == killers[1]:
+                score = self.killer_scores[1]
+            else:
+                score = history[
+                    (move.start_row * 8 + move.start_col) * 64
+                    + move.end_row * 8
+                    + move.end_col
+                ]
+            scored.append((score, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for _, move in scored]
+
+    """
+    A quiet move caused a beta cutoff: make it a killer for this ply and raise its
+    history
+    """
+
+    def record_cutoff(self, move, depth, ply):
+        killers = self.killers[ply]
+        if killers[0] != move.move_id:
+            killers[1] = killers[0]
+            killers[0] = move.move_id
+        start = move.start_row * 8 + move.start_col
+        self.history[start * 64 + move.end_row * 8 + move.end_col] += depth * depth
+
+
+"""
+What a search returns: the best move and score of the last completed iteration, its
+principal variation and the statistics of every completed iteration
+"""
+
+
+class SearchResult:
+
+    def __init__(self):
+        self.best_move = None
+        self.score = 0
+        self.depth = 0
+        self.pv = []
+        self.nodes = 0
+        self.qnodes = 0
+        self.time_ms = 0.0
+        self.null_move_cutoffs = 0
+        self.re_searches = 0
+        self.iterations = []
+
+
 """
 Helper method to make first recursive call
 """
 
 
-def find_best_move_min_max(gs, valid_moves):
-    global next_move
-    next_moves = None
-    # find_move_min_max(gs, valid_moves, depth_total, gs.white_to_move)
-    find_move_negamax_alphabeta(
-        gs,
-        valid_moves,
-        depth_total,
-        -checkmate,
-        checkmate,
-        1 if gs.white_to_move else -1,
+def find_best_move_min_max(gs, valid_moves, tt=None):
+    result = find_best_move_iterative(gs, valid_moves, max_depth=depth_total, tt=tt)
+    return result.best_move
+
+
+"""
+Iterative deepening: search depth 1, 2, 3... until the time (milliseconds) or node
+budget runs out. The move of the last completed iteration is returned, an unfinished
+iteration is thrown away
+"""
+
+
+def find_best_move_iterative(
+    gs,
+    valid_moves,
+    time_limit_ms=None,
+    node_limit=None,
+    max_depth=max_search_depth,
+    tt=None,
+    move_ordering=True,
+    quiescence=True,
+    cancel=None,
+    bitbases=None,
+    null_move=null_move_reduction,
+    late_moves=late_move_reduction,
+    full_depth=full_depth_moves,
+):
+    if bitbases is not None and bitbases.probe(gs) is not None:
+        # Already in the bitbases: probing would score every move that keeps the result
+        # the same, so only those moves are searched and the search finds the way on
+        valid_moves = bitbase_root_moves(gs, valid_moves, bitbases)
+        bitbases = None
+    ctx = SearchContext(
+        tt,
+        time_limit_ms,
+        node_limit,
+        move_ordering,
+        quiescence,
+        cancel,
+        bitbases,
+        null_move,
+        late_moves,
+        full_depth,
     )
-    return next_move
+    if tt is not None:
+        tt.new_search()
+    result = SearchResult()
+    turn_multiplier = 1 if gs.white_to_move else -1
+    start = time.perf_counter()
+    for depth in range(1, min(max_depth, max_search_depth) + 1):
+        iteration_start = time.perf_counter()
+        nodes_before = ctx.nodes
+        qnodes_before = ctx.qnodes
+        ctx.best_move = None
+        score = find_move_negamax_alphabeta(
+            gs, valid_moves, depth, -checkmate, checkmate, turn_multiplier, ctx
+        )
+        if ctx.stopped or ctx.best_move is None:
+            break
+        result.best_move = ctx.best_move
+        result.score = score
+        result.depth = depth
+        result.pv = list(ctx.pv[0])
+        result.iterations.append(
+            {
+                "depth": depth,
+                "score": score,
+                "nodes": ctx.nodes - nodes_before,
+                "qnodes": ctx.qnodes - qnodes_before,
+                "time_ms": (time.perf_counter() - iteration_start) * 1000,
+                "pv": [move.get_chess_notation() for move in result.pv],
+            }
+        )
+        # Search the best move of this iteration first in the next one
+        ctx.root_move_id = result.best_move.move_id
+        if abs(score) >= checkmate:  # Forced mate found, deeper won't change it
+            break
+    if result.best_move is None and len(valid_moves) != 0:
+        # Not even depth 1 finished in time, fall back to what there is
+        result.best_move = ctx.best_move
+        if result.best_move is None:
+            result.best_move = valid_moves[0]
+    result.nodes = ctx.nodes
+    result.qnodes = ctx.qnodes
+    result.null_move_cutoffs = ctx.null_move_cutoffs
+    result.re_searches = ctx.re_searches
+    result.time_ms = (time.perf_counter() - start) * 1000
+    return result
 
 
-def find_move_min_max(gs, valid_moves, depth, white_to_move):
-    global next_moves
+def find_move_min_max(gs, valid_moves, depth, white_to_move, ctx, ply=0):
+    ctx.count_node()
     if depth == 0:
         return score_material(gs.board)
     if white_to_move:
         max_score = -checkmate
         for move in valid_moves:
             gs.make_move(move)
-            score = find_move_min_max(gs, next_moves, depth - 1, False)
+            next_moves = gs.get_valid_moves()
+            score = find_move_min_max(gs, next_moves, depth - 1, False, ctx, ply + 1)
             if score > max_score:
                 max_score = score
-                if depth == depth_total:
-                    next_move = move
+                if ply == 0:
+                    ctx.best_move = move
             gs.undo_move()
         return max_score
     else:
@@ -96,17 +332,17 @@ def find_move_min_max(gs, valid_moves, depth, white_to_move):
         for move in valid_moves:
             gs.make_move(move)
             next_moves = gs.get_valid_moves()
-            score = find_move_min_max(gs, next_moves, depth - 1, True)
+            score = find_move_min_max(gs, next_moves, depth - 1, True, ctx, ply + 1)
             if score < min_score:
                 min_score = score
-                if depth == depth_total:
-                    next_move = move
+                if ply == 0:
+                    ctx.best_move = move
             gs.undo_move()
         return min_score
 
 
-def find_move_negamax(gs, valid_moves, depth, turnmultiplier):
-    global next_move
+def find_move_negamax(gs, valid_moves, depth, turnmultiplier, ctx, ply=0):
+    ctx.count_node()
     if depth == 0:
         return turnmultiplier * score_board(gs)
 
@@ -114,39 +350,327 @@ def find_move_negamax(gs, valid_moves, depth, turnmultiplier):
     for move in valid_moves:
         gs.make_move(move)
         next_moves = gs.get_valid_moves()
-        score = -find_move_negamax(gs, next_moves, depth - 1, -turnmultiplier)
+        score = -find_move_negamax(
+            gs, next_moves, depth - 1, -turnmultiplier, ctx, ply + 1
+        )
         if score > max_score:
             max_score = score
-            if depth == depth_total:
-                next_move = move
+            if ply == 0:
+                ctx.best_move = move
         gs.undo_move()
+    return max_score
+
 
+"""
+valid_moves is None below the root: the moves are then generated here, in stages when
+move ordering is on so that a cutoff skips generating the remaining ones. Null moves and
+late move reductions make the search selective, both are set on the SearchContext
+"""
 
-def find_move_negamax_alphabeta(gs, valid_moves, depth, alpha, beta, turnmultiplier):
-    global next_move
+
+def find_move_negamax_alphabeta(
+    gs, valid_moves, depth, alpha, beta, turnmultiplier, ctx, ply=0
+):
+    ctx.pv[ply] = []
+    if ply > 0 and gs.is_draw():  # Repetition or fifty moves, whatever follows
+        if ctx.count_node():
+            return 0
+        return stalemate
+    if ply > 0 and ctx.bitbases is not None:
+        wdl = ctx.bitbases.probe(gs)
+        if wdl is not None:
+            if ctx.count_node():
+                return 0
+            return bitbase_score(gs, wdl, turnmultiplier)
+    if depth == 0:
+        if valid_moves is None:
+            valid_moves = gs.get_valid_moves()  # Also sets checkmate and stalemate
+        if ctx.quiescence:
+            return quiescence_search(
+                gs, valid_moves, alpha, beta, turnmultiplier, ctx, ply
+            )
+    if ctx.count_node():
+        return 0  # Out of budget, the caller throws this iteration away
     if depth == 0:
         return turnmultiplier * score_board(gs)
 
-    # Move ordering -
-    max_score = -checkmate
-    for move in valid_moves:
-        gs.make_move(move)
-        next_moves = gs.get_valid_moves()
+    tt = ctx.tt
+    alpha_original = alpha
+    hash_move_id = ctx.root_move_id if ply == 0 else 0
+    if tt is not None:
+        entry = tt.probe(gs.zobrist_key)
+        if entry is not None:
+            entry_depth, entry_score, bound, entry_move_id = entry
+            # The root always searches so that the best move gets set
+            if entry_depth >= depth and ply != 0:
+                if bound == exact:
+                    return entry_score
+                elif bound == lower_bound:
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+            if entry_move_id:
+                hash_move_id = entry_move_id
+
+    in_check = depth >= reduction_min_depth and gs.king_in_check()
+    # Null move: let the opponent move twice. If a shallower search still fails high the
+    # position is good enough to cut off without trying a real move. Skipped in check,
+    # right after another null move and with only pawns left, where passing may be the
+    # best there is (zugzwang)
+    if (
+        ctx.null_move_reduction
+        and ply > 0
+        and depth >= reduction_min_depth
+        and not in_check
+        and beta < checkmate
+        and gs.move_log[-1] is not None
+        and turnmultiplier * gs.evaluate() >= beta
+        and gs.has_non_pawn_material()
+    ):
+        gs.make_null_move()
         score = -find_move_negamax_alphabeta(
-            gs, next_moves, depth - 1, -beta, -alpha, -turnmultiplier
+            gs,
+            None,
+            max(depth - 1 - ctx.null_move_reduction, 0),
+            -beta,
+            1 - beta,
+            -turnmultiplier,
+            ctx,
+            ply + 1,
         )
-        if score > max_score:
-            max_score = score
-            if depth == depth_total:
-                next_move = move
+        gs.undo_null_move()
+        if ctx.stopped:
+            return 0
+        if score >= beta:
+            ctx.null_move_cutoffs += 1
+            # A mate found after passing isn't a real one
+            return beta if score >= checkmate else score
+
+    # Move ordering
+    ordering = ctx.ordering
+    if valid_moves is None and ordering is not None:
+        valid_moves = staged_moves(gs, hash_move_id, ordering, ply)
+    else:
+        if valid_moves is None:
+            valid_moves = gs.get_valid_moves()
+        if ordering is not None:
+            valid_moves = ordering.order_moves(valid_moves, hash_move_id, ply)
+        else:
+            valid_moves = hash_move_first(valid_moves, hash_move_id)
+    max_score = -checkmate
+    best_move = None
+    reduce_late_moves = (
+        ctx.late_move_reduction and depth >= reduction_min_depth and not in_check
+    )
+    for i, move in enumerate(valid_moves):
+        gs.make_move(move)
+        # Late move reduction: a quiet move ordered late is searched shallower with a
+        # null window first, and again at full depth only if it beats alpha
+        if (
+            reduce_late_moves
+            and i >= ctx.full_depth_moves
+            and move.piece_captured == "  "
+            and not move.pawn_promotion
+            and not gs.king_in_check()
+        ):
+            score = -find_move_negamax_alphabeta(
+                gs,
+                None,
+                max(depth - 1 - ctx.late_move_reduction, 0),
+                -alpha - 1,
+                -alpha,
+                -turnmultiplier,
+                ctx,
+                ply + 1,
+            )
+            if score > alpha and not ctx.stopped:
+                ctx.re_searches += 1
+                score = -find_move_negamax_alphabeta(
+                    gs, None, depth - 1, -beta, -alpha, -turnmultiplier, ctx, ply + 1
+                )
+        else:
+            score = -find_move_negamax_alphabeta(
+                gs, None, depth - 1, -beta, -alpha, -turnmultiplier, ctx, ply + 1
+            )
         gs.undo_move()
+        if ctx.stopped:
+            return 0
+        # The first move is kept even when it gets mated, best_move None means no moves
+        if score > max_score or best_move is None:
+            max_score = score
+            best_move = move
+            if ply == 0:
+                ctx.best_move = move
+            if score > alpha:
+                ctx.pv[ply] = [move] + ctx.pv[ply + 1]
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
+            if ordering is not None and move.piece_captured == "  ":
+                ordering.record_cutoff(move, depth, ply)
             break
+
+    if best_move is None:
+        # No legal moves and nothing played since they were generated, in_check is ours
+        max_score = -checkmate if gs.in_check else stalemate
+
+    if tt is not None:
+        if max_score <= alpha_original:
+            bound = upper_bound
+        elif max_score >= beta:
+            bound = lower_bound
+        else:
+            bound = exact
+        tt.store(
+            gs.zobrist_key,
+            depth,
+            max_score,
+            bound,
+            best_move.move_id if best_move is not None else 0,
+        )
     return max_score
 
 
+"""
+Quiescence search: past the horizon only captures and queen promotions are searched
+(all moves when in check), until the position is quiet. The side to move may also stand
+pat on the static score, and captures that can't raise the score to alpha even with a
+margin are skipped (delta pruning)
+"""
+
+
+def quiescence_search(gs, valid_moves, alpha, beta, turnmultiplier, ctx, ply):
+    if ctx.count_node(quiescence=True):
+        return 0
+    stand_pat = turnmultiplier * score_board(gs)
+    if gs.checkmate or gs.stalemate or ply >= max_search_depth:
+        return stand_pat
+    in_check = gs.in_check
+    if in_check:  # No standing pat in check, every evasion is searched
+        max_score = -checkmate
+        moves = valid_moves
+    else:
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        max_score = stand_pat
+        moves = [
+            move
+            for move in valid_moves
+            if move.promotion_piece == "Q"
+            or (move.piece_captured != "  " and not move.pawn_promotion)
+        ]
+    if ctx.ordering is not None:
+        moves = ctx.ordering.order_moves(moves, 0, ply)
+    for move in moves:
+        if (
+            not in_check
+            and not move.pawn_promotion
+            and stand_pat + piece_score[move.piece_captured[1]] + delta_margin <= alpha
+        ):
+            continue
+        gs.make_move(move)
+        next_moves = gs.get_valid_moves()
+        score = -quiescence_search(
+            gs, next_moves, -beta, -alpha, -turnmultiplier, ctx, ply + 1
+        )
+        gs.undo_move()
+        if ctx.stopped:
+            return 0
+        if score > max_score:
+            max_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return max_score
+
+
+"""
+Staged move picker: the hash move is tried before anything is generated, then the
+captures (and promotions) by MVV-LVA, the killers, and last the quiet moves by history.
+Each stage is only generated once the search has gone through the previous one without
+a cutoff
+"""
+
+
+def staged_moves(gs, hash_move_id, ordering, ply):
+    hash_move = gs.get_legal_move(hash_move_id) if hash_move_id else None
+    if hash_move is not None:
+        yield hash_move
+    for move in ordering.order_moves(gs.get_valid_moves(capture_moves), 0, ply):
+        if move.move_id != hash_move_id:
+            yield move
+    killer_ids = []
+    for killer_id in ordering.killers[ply]:
+        if killer_id and killer_id != hash_move_id:
+            killer = gs.get_legal_move(killer_id)
+            # A killer from a sibling may be a capture here, that was searched already
+            if (
+                killer is not None
+                and killer.piece_captured == "  "
+                and not killer.pawn_promotion
+            ):
+                killer_ids.append(killer_id)
+                yield killer
+    for move in ordering.order_moves(gs.get_valid_moves(quiet_moves), 0, ply):
+        if move.move_id != hash_move_id and move.move_id not in killer_ids:
+            yield move
+
+
+"""
+Put the move the transposition table found best last time at the front of the list
+"""
+
+
+def hash_move_first(valid_moves, hash_move_id):
+    if hash_move_id:
+        for i in range(len(valid_moves)):
+            if valid_moves[i].move_id == hash_move_id:
+                return [valid_moves[i]] + valid_moves[:i] + valid_moves[i + 1 :]
+    return valid_moves
+
+
+"""
+Score of a position the bitbases know, for the side to move. Wins and losses are offset
+by bitbase_win, the evaluation on top tells apart positions closer to the goal (the lone
+king nearer the edge, the pawn further up). A mate is still scored as a mate
+"""
+
+
+def bitbase_score(gs, wdl, turnmultiplier):
+    if wdl == draw:
+        return stalemate
+    if wdl == loss and len(gs.get_valid_moves()) == 0:
+        return -checkmate
+    return wdl * bitbase_win + turnmultiplier * gs.evaluate()
+
+
+"""
+The moves that keep the best bitbase result of the position
+"""
+
+
+def bitbase_root_moves(gs, valid_moves, bitbases):
+    best = None
+    kept = []
+    for move in valid_moves:
+        gs.make_move(move)
+        wdl = bitbases.probe(gs)
+        gs.undo_move()
+        if wdl is None:
+            return valid_moves
+        if best is None or -wdl > best:
+            best = -wdl
+            kept = [move]
+        elif -wdl == best:
+            kept.append(move)
+    return kept
+
+
 def score_board(gs):
     if gs.checkmate:
         if gs.white_to_move:
@@ -155,15 +679,7 @@ def score_board(gs):
             return checkmate
     elif gs.stalemate:
         return stalemate
-    score = 0
-    for row in gs.board:
-        for square in row:
-            if square[0] == "w":
-                score += piece_score[square[1]]
-            elif square[0] == "b":
-                score -= piece_score[square[1]]
-
-    return score
+    return gs.evaluate()  # Kept up to date by make_move / undo_move, no board scan
 
 
 """
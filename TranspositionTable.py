@@ -0,0 +1,117 @@
+from array import array
+
+# Bound types, telling whether the stored score is exact or only a bound on the real one
+exact = 0
+lower_bound = 1
+upper_bound = 2
+
+entries_per_bucket = 2
+bytes_per_entry = 16  # 8 byte key and 8 bytes of packed data
+
+score_offset = 1 << 29  # Scores are stored unsigned in the top 30 bits
+
+"""
+Fixed size hash table of search results keyed by GameState.zobrist_key.
+Each bucket has two slots: a depth-preferred slot that only gives way to deeper (or
+older) results and an always-replace slot that takes everything else, so shallow results
+near the leaves can't push out expensive ones from near the root.
+Entries are packed into two preallocated arrays, the memory used is fixed when the table
+is created and doesn't grow as the game goes on.
+"""
+
+
+class TranspositionTable:
+
+    def __init__(self, size_mb=16):
+        self.size_mb = size_mb
+        self.bucket_count = max(
+            1, size_mb * 1024 * 1024 // (entries_per_bucket * bytes_per_entry)
+        )
+        self.keys = array("Q", bytes(8 * entries_per_bucket * self.bucket_count))
+        self.data = array("Q", bytes(8 * entries_per_bucket * self.bucket_count))
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+    """
+    Start a new search, results from earlier searches become replaceable in the
+    depth-preferred slots but are still used until then
+    """
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        size = len(self.keys)
+        self.keys = array("Q", bytes(8 * size))
+        self.data = array("Q", bytes(8 * size))
+        self.generation = 0
+
+    """
+    Returns (depth, score, bound, move_id) for a position or None, move_id is 0 when no
+    best move is known
+    """
+
+    def probe(self, key):
+        slot = (key % self.bucket_count) * entries_per_bucket
+        keys = self.keys
+        if keys[slot] == key:
+            data = self.data[slot]
+        elif keys[slot + 1] == key:
+            data = self.data[slot + 1]
+        else:
+            self.misses += 1
+            if keys[slot] or keys[slot + 1]:  # Bucket taken by other positions
+                self.collisions += 1
+            return None
+        self.hits += 1
+        return (
+            (data >> 8) & 0xFF,
+            (data >> 34) - score_offset,
+            (data >> 16) & 0x3,
+            (data >> 18) & 0xFFFF,
+        )
+
+    def store(self, key, depth, score, bound, move_id=0):
+        slot = (key % self.bucket_count) * entries_per_bucket
+        data = (
+            self.generation
+            | depth << 8
+            | bound << 16
+            | move_id << 18
+            | (score + score_offset) << 34
+        )
+        self.stores += 1
+        keys = self.keys
+        stored = self.data[slot]
+        if (
+            keys[slot] == 0
+            or keys[slot] == key
+            or depth >= (stored >> 8) & 0xFF
+            or stored & 0xFF != self.generation
+        ):
+            if keys[slot] != key and keys[slot] != 0:
+                # Demote the old result to the always-replace slot
+                keys[slot + 1] = keys[slot]
+                self.data[slot + 1] = stored
+            keys[slot] = key
+            self.data[slot] = data
+        else:
+            keys[slot + 1] = key
+            self.data[slot + 1] = data
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def stats(self):
+        return {
+            "size_mb": self.size_mb,
+            "hits": self.hits,
+            "misses": self.misses,
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "hit_rate": self.hit_rate(),
+        }